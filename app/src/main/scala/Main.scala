@@ -1,9 +1,13 @@
-import hocki.klocki.pipeline.runPipeline
+import hocki.klocki.pipeline.{runPipeline, serve}
 
 object Main:
   def main(args: Array[String]): Unit =
+    if args.headOption.contains("--serve") then
+      serve()
+      return
+
     if args.length < 2 then
-      println("App requires two argument {source filename} {target filename}")
+      println("App requires two argument {source filename} {target filename}, or --serve")
       return
 
     println(args.mkString("Array(", ", ", ")"))
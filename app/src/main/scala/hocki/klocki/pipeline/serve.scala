@@ -0,0 +1,57 @@
+package hocki.klocki.pipeline
+
+import java.io.{BufferedInputStream, BufferedOutputStream, ByteArrayOutputStream, DataInputStream, DataOutputStream, EOFException, PrintStream}
+import java.nio.charset.StandardCharsets.UTF_8
+
+// Keeps one JVM answering pipeline requests, so the web app pays startup and JIT warm-up once.
+// Every message is a 4-byte big-endian length followed by that many bytes of UTF-8 JSON:
+//   {"id": 1, "kind": "ping"}
+//   {"id": 2, "kind": "compile", "source": "...", "output": "...", "expansionDepth": 2, "typing": "..."}
+// Answers carry the same id, whether the request succeeded and what the pipeline printed.
+def serve(): Unit =
+  val input = DataInputStream(BufferedInputStream(System.in))
+  val output = DataOutputStream(BufferedOutputStream(System.out))
+  // stdout carries frames only, anything printed outside a request goes to stderr
+  System.setOut(System.err)
+
+  var request = readFrame(input)
+  while request.isDefined do
+    writeFrame(output, handle(ujson.read(request.get)))
+    request = readFrame(input)
+
+private def handle(request: ujson.Value): ujson.Value =
+  val id = request("id")
+  request("kind").str match
+    case "ping" => ujson.Obj("id" -> id, "ok" -> true)
+    case "compile" =>
+      val log = ByteArrayOutputStream()
+      val ok =
+        Console.withOut(PrintStream(log, true, UTF_8)) {
+          try
+            runPipeline(
+              request("source").str,
+              request("output").str,
+              request("expansionDepth").num.toInt,
+              request.obj.get("typing").flatMap(_.strOpt),
+            )
+          catch
+            case e: Exception =>
+              println(s"TRAGEDY: $e")
+              e.printStackTrace()
+              false
+        }
+      ujson.Obj("id" -> id, "ok" -> ok, "log" -> log.toString(UTF_8))
+    case kind => ujson.Obj("id" -> id, "ok" -> false, "log" -> s"Unknown request kind: $kind")
+
+private def readFrame(input: DataInputStream): Option[String] =
+  try
+    val bytes = new Array[Byte](input.readInt())
+    input.readFully(bytes)
+    Some(String(bytes, UTF_8))
+  catch case _: EOFException => None
+
+private def writeFrame(output: DataOutputStream, message: ujson.Value): Unit =
+  val bytes = ujson.write(message).getBytes(UTF_8)
+  output.writeInt(bytes.length)
+  output.write(bytes)
+  output.flush()
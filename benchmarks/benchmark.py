@@ -0,0 +1,384 @@
+"""
+Scaling benchmarks for typing and visualization.
+
+Generates programs of growing size (add/remove chains, wide U{n} fan-ins,
+deeply nested defs, many instances of one generic schema, recursive
+schemas) and times infer_types from the prototype, and Program.from_dto
+and program_to_graphviz from the webapp on the same programs.
+
+    python benchmarks/benchmark.py --output before.json
+    python benchmarks/benchmark.py --output after.json --compare before.json
+
+With --compare, rows slower than the baseline by more than --threshold
+are reported as regressions and the exit status is 1.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "webapp"))
+sys.path.insert(0, os.path.join(ROOT, "prototype"))
+
+from model import Program
+from visualization import program_to_graphviz
+
+def load_prototype():
+    # the file name is not a valid module name. It is registered under this
+    # one, so that pickles sent to worker processes can refer to it
+    path = os.path.join(ROOT, "prototype", "first-baby-version-algorithm.py")
+    spec = importlib.util.spec_from_file_location("first_baby_version_algorithm", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+proto = load_prototype()
+
+
+class Workload:
+    """
+    A program in a form both the prototype and the webapp can be built
+    from: schemas over integer vertices, builtins described by kind.
+    """
+
+    def __init__(self):
+        self.schemas = []
+        self.next_vertex = 0
+        self.dims = {}
+
+    def vertex(self) -> int:
+        self.next_vertex += 1
+        return self.next_vertex - 1
+
+    def dim(self, name: str) -> int:
+        return self.dims.setdefault(name, len(self.dims))
+
+    def add_schema(self, name: str, in_count: int, out_count: int, builtin=None) -> int:
+        self.schemas.append({
+            "name": name,
+            "builtin": builtin,
+            "in": [self.vertex() for _ in range(in_count)],
+            "out": [self.vertex() for _ in range(out_count)],
+            "blocks": [],
+            "edges": [],
+        })
+        return len(self.schemas) - 1
+
+    def add(self, dim: str) -> int:
+        return self.add_schema(f"builtin +{dim}", 1, 1, ("add", dim))
+
+    def remove(self, dim: str) -> int:
+        return self.add_schema("builtin -", 1, 1, ("remove", dim))
+
+    def union(self, arity: int) -> int:
+        return self.add_schema(f"builtin U{{{arity}}}", arity, 1, ("union", arity))
+
+    def use(self, parent: int, child: int) -> Tuple[List[int], List[int]]:
+        # a block of `child` in `parent`, returns its fresh in and out vertices
+        mapping = {v: self.vertex() for v in self.schemas[child]["in"] + self.schemas[child]["out"]}
+        self.schemas[parent]["blocks"].append((child, mapping))
+        return [mapping[v] for v in self.schemas[child]["in"]], [mapping[v] for v in self.schemas[child]["out"]]
+
+    def link(self, parent: int, source: int, target: int):
+        self.schemas[parent]["edges"].append((source, target))
+
+    def chain(self, parent: int, source: int, children: List[int]) -> int:
+        # links single input and output blocks of `children` one after another
+        for child in children:
+            (x,), (y,) = self.use(parent, child)
+            self.link(parent, source, x)
+            source = y
+        return source
+
+    def to_dto(self) -> dict:
+        # the JSON the backend writes for the webapp, see visualize/graph/model.scala
+        dim_set_vars = {v: f"V{v}" for v in range(self.next_vertex)}
+        dims = {i: name for name, i in self.dims.items()}
+        schemata = []
+        for i, s in enumerate(self.schemas):
+            universal = []
+            dim_mapping = {}
+            if s["builtin"] and s["builtin"][0] == "remove":
+                # "-" is generic over the dim it removes, every use gets its own parameter
+                universal = [len(dims)]
+                dims[universal[0]] = "α0"
+            schemata.append({
+                "id": i,
+                "name": s["name"],
+                "interface": {
+                    "universalDims": universal,
+                    "existentialDims": [],
+                    "inVertices": s["in"],
+                    "outVertices": s["out"],
+                },
+                "blocks": [
+                    {
+                        "schemaId": child,
+                        "interfaceMapping": sorted(mapping.items()),
+                        "dimMapping": self.dim_mapping(child, schemata, dim_mapping),
+                    }
+                    for child, mapping in s["blocks"]
+                ],
+                "edges": [list(e) for e in s["edges"]],
+            })
+        return {
+            "dims": sorted(dims.items()),
+            "globalDims": sorted(self.dims.values()),
+            "dimSetVars": sorted(dim_set_vars.items()),
+            "schemata": schemata,
+        }
+
+    def dim_mapping(self, child: int, schemata: List[dict], cache: Dict) -> List[List[int]]:
+        builtin = self.schemas[child]["builtin"]
+        if not builtin or builtin[0] != "remove":
+            return []
+        # parameters of builtins are numbered after the global dims, in schema order
+        parameter = len(self.dims) + sum(
+            1 for s in self.schemas[:child] if s["builtin"] and s["builtin"][0] == "remove"
+        )
+        return [[parameter, self.dims[builtin[1]]]]
+
+    def to_prototype(self) -> Tuple[List, Dict]:
+        # BlockSchemas of the prototype and the typing of their builtins
+        vertices = {}
+
+        def vertex(v, make):
+            if v not in vertices:
+                vertices[v] = make()
+            return vertices[v]
+
+        typing = {}
+        schemas = []
+        for s in self.schemas:
+            ins = [vertex(v, proto.Vertex.input) for v in s["in"]]
+            outs = [vertex(v, proto.Vertex.output) for v in s["out"]]
+            schemas.append(proto.BlockSchema(ins, outs, [], {}))
+            if s["builtin"]:
+                kind, argument = s["builtin"]
+                if kind == "add":
+                    typing[schemas[-1]] = proto.add_fresh_dim_type(argument)
+                elif kind == "remove":
+                    typing[schemas[-1]] = proto.remove_dim_type(argument)
+                else:
+                    typing[schemas[-1]] = proto.union_type(argument)
+        for s, schema in zip(self.schemas, schemas):
+            for child, mapping in s["blocks"]:
+                child_schema = schemas[child]
+                in_vertices = self.schemas[child]["in"]
+                schema.blocks.append(proto.Block(child_schema, {
+                    proto_vertex: vertex(mapping[v], proto.Vertex.input if v in in_vertices else proto.Vertex.output)
+                    for v, proto_vertex in zip(
+                        self.schemas[child]["in"] + self.schemas[child]["out"],
+                        child_schema.in_vertices + child_schema.out_vertices,
+                    )
+                }))
+            for source, target in s["edges"]:
+                schema.edges.setdefault(vertices[source], []).append(vertices[target])
+        return schemas, typing
+
+
+# every generator returns the workload and the index of its main schema
+
+def add_remove_chain(n: int) -> Tuple[Workload, int]:
+    # X -> +f0 -> ... -> +f(n-1) -> -f(n-1) -> ... -> -f0 -> Y
+    w = Workload()
+    main = w.add_schema("main", 1, 1)
+    adds = [w.add(f"f{i}") for i in range(n)]
+    removes = [w.remove(f"f{i}") for i in reversed(range(n))]
+    for i in range(n):
+        w.dim(f"f{i}")
+    out = w.chain(main, w.schemas[main]["in"][0], adds + removes)
+    w.link(main, out, w.schemas[main]["out"][0])
+    return w, main
+
+def union_fan_in(n: int) -> Tuple[Workload, int]:
+    # n inputs, each adding its own dim, joined by U{n}
+    w = Workload()
+    main = w.add_schema("main", n, 1)
+    union_ins, (union_out,) = w.use(main, w.union(n))
+    for i, (x, u) in enumerate(zip(w.schemas[main]["in"], union_ins)):
+        w.dim(f"f{i}")
+        w.link(main, w.chain(main, x, [w.add(f"f{i}")]), u)
+    w.link(main, union_out, w.schemas[main]["out"][0])
+    return w, main
+
+def nested_defs(n: int) -> Tuple[Workload, int]:
+    # level k adds and removes its own dim around a use of level k - 1
+    w = Workload()
+    inner = None
+    for k in range(n):
+        w.dim(f"f{k}")
+        level = w.add_schema(f"level{k}", 1, 1)
+        children = [w.add(f"f{k}")] + ([inner] if inner is not None else []) + [w.remove(f"f{k}")]
+        w.link(level, w.chain(level, w.schemas[level]["in"][0], children), w.schemas[level]["out"][0])
+        inner = level
+    return w, inner
+
+def generic_instances(n: int) -> Tuple[Workload, int]:
+    # one schema adding and removing a dim, used n times in a row
+    w = Workload()
+    w.dim("f")
+    generic = w.add_schema("generic", 1, 1)
+    w.link(generic, w.chain(generic, w.schemas[generic]["in"][0], [w.add("f"), w.remove("f")]), w.schemas[generic]["out"][0])
+    main = w.add_schema("main", 1, 1)
+    w.link(main, w.chain(main, w.schemas[main]["in"][0], [generic] * n), w.schemas[main]["out"][0])
+    return w, main
+
+def recursive_schema(n: int) -> Tuple[Workload, int]:
+    # r = U{2}(X, r(X through n add/remove pairs))
+    w = Workload()
+    r = w.add_schema("r", 1, 1)
+    pairs = []
+    for i in range(n):
+        w.dim(f"f{i}")
+        pairs += [w.add(f"f{i}"), w.remove(f"f{i}")]
+    x = w.schemas[r]["in"][0]
+    before_call = w.chain(r, x, pairs)
+    (u0, u1), (u_out,) = w.use(r, w.union(2))
+    w.link(r, x, u0)
+    w.link(r, w.chain(r, before_call, [r]), u1)
+    w.link(r, u_out, w.schemas[r]["out"][0])
+    return w, r
+
+# default sizes stay within a few seconds per row, the fan-in grows exponentially with n
+WORKLOADS: Dict[str, Tuple[Callable[[int], Tuple[Workload, int]], List[int]]] = {
+    "add_remove_chain": (add_remove_chain, [4, 8, 16, 32]),
+    "union_fan_in": (union_fan_in, [2, 4, 6]),
+    "nested_defs": (nested_defs, [4, 8, 16, 32]),
+    "generic_instances": (generic_instances, [8, 16, 32, 64]),
+    "recursive_schema": (recursive_schema, [2, 4, 8]),
+}
+
+
+class FactCounter(proto.InferenceObserver):
+    def __init__(self):
+        self.derived_facts = 0
+        self.peak_facts = 0
+
+    def facts(self, stage, facts):
+        if stage == "after":
+            self.derived_facts += len(facts)
+        self.peak_facts = max(self.peak_facts, len(facts))
+
+    def iteration(self, number, facts, new_facts, rules):
+        self.peak_facts = max(self.peak_facts, facts)
+
+def measure(run: Callable[[], Optional[dict]], repeat: int, min_seconds: float = 0.05) -> dict:
+    # best time of `repeat` rounds, peak memory of one more run under tracemalloc.
+    # Fast tasks loop within a round until it lasts min_seconds, like timeit does.
+    started = time.perf_counter()
+    extra = run() or {}
+    number = max(1, int(min_seconds / max(time.perf_counter() - started, 1e-9)))
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            run()
+        seconds.append((time.perf_counter() - started) / number)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_memory": peak, **extra}
+
+def bench_infer_types(workload: Workload, main: int) -> dict:
+    def run():
+        schemas, typing = workload.to_prototype()
+        counter = FactCounter()
+        proto.infer_types(schemas[main], typing, observer=counter)
+        return {"facts": counter.derived_facts, "peak_facts": counter.peak_facts}
+    return run
+
+def run_benchmarks(workloads: List[str], sizes: Optional[List[int]], depths: List[int], repeat: int) -> List[dict]:
+    results = []
+    for name in workloads:
+        generate, default_sizes = WORKLOADS[name]
+        for size in sizes or default_sizes:
+            workload, main = generate(size)
+            dto = workload.to_dto()
+            rows = [("infer_types", None, bench_infer_types(workload, main))]
+            rows.append(("Program.from_dto", None, lambda: Program.from_dto(dto) and None))
+            program = Program.from_dto(dto)
+            for depth in depths:
+                rows.append(("program_to_graphviz", depth, lambda depth=depth: program_to_graphviz(program, depth) and None))
+            for task, depth, run in rows:
+                result = {"workload": name, "size": size, "task": task, "depth": depth, **measure(run, repeat)}
+                results.append(result)
+                print(format_row(result), file=sys.stderr)
+    return results
+
+def row_key(result: dict) -> Tuple:
+    return result["workload"], result["size"], result["task"], result["depth"]
+
+def format_row(result: dict) -> str:
+    depth = "" if result["depth"] is None else f" depth={result['depth']}"
+    facts = f" facts={result['facts']}" if "facts" in result else ""
+    return (
+        f"{result['workload']:<18} n={result['size']:<5} {result['task']}{depth}: "
+        f"{result['seconds'] * 1000:.2f} ms, {result['peak_memory'] / 1024:.0f} KiB{facts}"
+    )
+
+def compare(baseline: dict, current: dict, threshold: float) -> List[str]:
+    # rows of both runs, slower ones than `threshold` times the baseline marked
+    old = {row_key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = old.get(row_key(result))
+        if before is None:
+            continue
+        ratio = result["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+        marker = "  REGRESSION" if ratio > threshold else ""
+        line = (
+            f"{format_row(result)} (was {before['seconds'] * 1000:.2f} ms, x{ratio:.2f}, "
+            f"memory x{result['peak_memory'] / max(before['peak_memory'], 1):.2f}){marker}"
+        )
+        print(line)
+        if marker:
+            regressions.append(line)
+    return regressions
+
+def revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="where to write the results as JSON")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown counted as a regression")
+    parser.add_argument("--workloads", nargs="+", choices=list(WORKLOADS), default=list(WORKLOADS))
+    parser.add_argument("--sizes", type=int, nargs="+", help="sizes for every workload instead of their defaults")
+    parser.add_argument("--depths", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    current = {
+        "revision": revision(),
+        "python": platform.python_version(),
+        "results": run_benchmarks(args.workloads, args.sizes, args.depths, args.repeat),
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
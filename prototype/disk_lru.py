@@ -0,0 +1,53 @@
+"""
+Eviction for caches that keep one file per entry in a directory and
+refresh the modification time of an entry whenever it is read, so that
+modification times order the entries by their last use.
+"""
+import os
+
+class LruEviction:
+    """
+    Keeps about max_entries files ending in `suffix` in `directory`.
+    Rather than listing the directory on every write, it counts the new
+    entries and lists it only once there are more than max_entries, then
+    removes the least recently used down to nine tenths of max_entries.
+    A listing is thus paid for by the writes since the previous one.
+    The count is per process and not locked: other processes or a lost
+    update only make the next listing come earlier or later.
+    """
+
+    def __init__(self, directory: str, max_entries: int, suffix: str = ".json"):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.suffix = suffix
+        self.count = len(self.entries())
+
+    def entries(self) -> list:
+        # (modification time, name) of every entry, least recently used first
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                try:
+                    entries.append((os.path.getmtime(os.path.join(self.directory, name)), name))
+                except OSError:
+                    pass
+        entries.sort()
+        return entries
+
+    def added(self):
+        # call once an entry was written that was not there before
+        self.count += 1
+        if self.count > self.max_entries:
+            self.evict()
+
+    def evict(self):
+        entries = self.entries()
+        if len(entries) > self.max_entries:
+            keep = self.max_entries - self.max_entries // 10
+            for _, name in entries[:len(entries) - keep]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            entries = entries[len(entries) - keep:]
+        self.count = len(entries)
@@ -1,126 +1,446 @@
-from dataclasses import dataclass
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import weakref
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from itertools import chain, product
 
 from abc import ABC, abstractmethod
 from typing import *
 from typing import Dict
 
+from disk_lru import LruEviction
+from inference_worker import infer_in_worker, init_worker
+
+try:
+    import numpy as np
+except ImportError:
+    # blocks are then instantiated one by one
+    np = None
+
 type Dim = str
 type DimSetVar = str
 
-class DirectConstraint[V](ABC):
+# dims are interned to small integers and sets of dims are bitmasks over them
+type DimId = int
+type DimSet = int
+
+class DimTable:
+    def __init__(self):
+        self.ids: Dict[Dim, DimId] = {}
+        self.names: List[Dim] = []
+
+    def intern(self, dim: Dim) -> DimId:
+        if dim not in self.ids:
+            self.ids[dim] = len(self.names)
+            self.names.append(dim)
+        return self.ids[dim]
+
+    def name(self, dim: DimId) -> Dim:
+        return self.names[dim]
+
+    def dim_set(self, dims: Iterable[Dim]) -> DimSet:
+        result = 0
+        for d in dims:
+            result |= 1 << self.intern(d)
+        return result
+
+    def dim_set_str(self, dims: DimSet) -> str:
+        return ",".join(self.names[d] for d in dims_of(dims))
+
+    def dim_set_names(self, dims: DimSet) -> List[Dim]:
+        return [self.names[d] for d in dims_of(dims)]
+
+dim_table = DimTable()
+
+def has_dim(dims: DimSet, dim: DimId) -> bool:
+    return bool(dims >> dim & 1)
+
+def is_subset(lhs: DimSet, rhs: DimSet) -> bool:
+    return (lhs & ~rhs) == 0
+
+def dims_of(dims: DimSet) -> Iterator[DimId]:
+    d = 0
+    while dims:
+        if dims & 1:
+            yield d
+        dims >>= 1
+        d += 1
+
+class HashConsed:
+    """
+    Base for immutable values of which each distinct one exists only once.
+    Constructing an equal value returns the existing instance, so equality
+    is identity and the hash is computed once on construction.
+    Subclasses list their fields in __slots__ and are built positionally,
+    after passing through `normalized` so that equivalent values coincide.
+    """
+    __slots__ = ('_hash', '__weakref__')
+    # weak, so that facts dropped during inference can be freed
+    _instances = weakref.WeakValueDictionary()
+    # fields holding a DimId or a DimSet, pickled by dim names
+    dim_fields = ()
+    dim_set_fields = ()
+
+    def __new__(cls, *args):
+        args = cls.normalized(*args)
+        key = (cls, args)
+        instance = HashConsed._instances.get(key)
+        if instance is None:
+            instance = super().__new__(cls)
+            for name, value in zip(cls.__slots__, args):
+                object.__setattr__(instance, name, value)
+            object.__setattr__(instance, '_hash', hash(key))
+            HashConsed._instances[key] = instance
+        return instance
+
+    @staticmethod
+    def normalized(*args):
+        return args
+
+    def __hash__(self):
+        return self._hash
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        # dim ids depend on the order in which a process interned the dims
+        cls = type(self)
+        fields = tuple(
+            dim_table.name(value) if name in cls.dim_fields
+            else dim_table.dim_set_names(value) if name in cls.dim_set_fields
+            else value
+            for name, value in zip(cls.__slots__, self.fields())
+        )
+        return unpickle_hash_consed, (cls, fields)
+
+    def fields(self):
+        return tuple(getattr(self, f) for f in type(self).__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.fields()}"
+
+def unpickle_hash_consed(cls, fields):
+    return cls(*(
+        dim_table.intern(value) if name in cls.dim_fields
+        else dim_table.dim_set(value) if name in cls.dim_set_fields
+        else value
+        for name, value in zip(cls.__slots__, fields)
+    ))
+
+class DirectConstraint[V](HashConsed, ABC):
+    __slots__ = ()
+
     @abstractmethod
     def mapped[W](self, mapping: Dict[V, W]) -> 'DirectConstraint[W]':
         pass
 
-class IndirectConstraint[V](ABC):
+    @abstractmethod
+    def encoded(self, encode_var) -> list:
+        # JSON friendly form with dims by name, used to store types
+        pass
+
+class IndirectConstraint[V](HashConsed, ABC):
+    __slots__ = ()
+
     @abstractmethod
     def mapped[W](self, mapping: Dict[V, W]) -> 'IndirectConstraint[W]':
         pass
 
+    @abstractmethod
+    def encoded(self, encode_var) -> list:
+        pass
+
 # a \in Union(X)
-@dataclass(frozen=True)
 class InUnion[V](DirectConstraint):
-    dim: Dim
+    __slots__ = ('dim', 'dim_set_vars')
+    dim_fields = ('dim',)
+    dim: DimId
     dim_set_vars: Tuple[V]
 
+    @staticmethod
+    def normalized(dim, dim_set_vars):
+        return dim, tuple(sorted(set(dim_set_vars), key=var_key))
+
     def mapped[W](self, mapping: Dict[V, W]) -> 'InUnion[W]':
         return InUnion(self.dim, tuple(mapping[d] for d in self.dim_set_vars))
+
+    def encoded(self, encode_var) -> list:
+        return ["in_union", dim_table.name(self.dim), sorted(encode_var(d) for d in self.dim_set_vars)]
     
     def __str__(self):
         dim_set_vars_str = ",".join(str(d) for d in self.dim_set_vars)
         if len(self.dim_set_vars) == 1:
-            return f"{self.dim} in {dim_set_vars_str}"
+            return f"{dim_table.name(self.dim)} in {dim_set_vars_str}"
         else:
-            return f"{self.dim} in Union({dim_set_vars_str})"
+            return f"{dim_table.name(self.dim)} in Union({dim_set_vars_str})"
 
 
 # a \notin X
-@dataclass(frozen=True)
 class NotIn[V](DirectConstraint):
-    dim: Dim
+    __slots__ = ('dim', 'dim_set_var')
+    dim_fields = ('dim',)
+    dim: DimId
     dim_set_var: V
 
     def mapped[W](self, mapping: Dict[V, W]) -> 'NotIn[W]':
         return NotIn(self.dim, mapping[self.dim_set_var])
 
+    def encoded(self, encode_var) -> list:
+        return ["not_in", dim_table.name(self.dim), encode_var(self.dim_set_var)]
+
     def __str__(self):
-        return f"{self.dim} not in {self.dim_set_var}"
+        return f"{dim_table.name(self.dim)} not in {self.dim_set_var}"
 
 # X = Y
-@dataclass(frozen=True)
 class Equal[V](DirectConstraint):
+    __slots__ = ('lhs', 'rhs')
     lhs: V
     rhs: V
 
     def mapped[W](self, mapping: Dict[V, W]) -> 'DirectConstraint[W]':
         return Equal(mapping[self.lhs], mapping[self.rhs])
+
+    def encoded(self, encode_var) -> list:
+        return ["equal", encode_var(self.lhs), encode_var(self.rhs)]
     
     def str(self):
         return f"{self.lhs} == {self.rhs}"
     
 
-@dataclass(frozen=True)
-class Inducer[V]:
+class Inducer[V](HashConsed):
+    __slots__ = ('dim_set_var', 'filtered_dims')
+    dim_set_fields = ('filtered_dims',)
     dim_set_var: V
-    filtered_dims: Tuple[Dim]
+    filtered_dims: DimSet
 
     def mapped[W](self, mapping: Dict[V, W]) -> 'Inducer[W]':
         return Inducer(mapping[self.dim_set_var], self.filtered_dims)
+
+    def encoded(self, encode_var) -> list:
+        return [encode_var(self.dim_set_var), sorted(dim_table.dim_set_names(self.filtered_dims))]
     
     def __str__(self):
-        if len(self.filtered_dims) == 0:
+        if self.filtered_dims == 0:
             return str(self.dim_set_var)
         else:
-            dims_str = ",".join(str(d) for d in self.filtered_dims)
+            dims_str = dim_table.dim_set_str(self.filtered_dims)
             return f"{self.dim_set_var} ? {{{dims_str}}}"
 
 # Y <== Union(X_1 ? A_1, ..., X_n ? A_n)
-@dataclass(frozen=True)
+#
+# Every dim of some X_i that is not in A_i is in Y. Every dim of Y that is
+# not in F comes from some X_i, where the fresh dims F are the dims that
+# may be in Y without coming from an inducer. F contains every A_i,
+# so it is only shown when it has more, e.g. Y <== X with {a} fresh
+# stands for Y <== Union(X, X ? {a}), where a may be fresh in Y.
 class InducedBy[V](IndirectConstraint):
+    __slots__ = ('induced', 'inducers', 'fresh_dims')
+    dim_set_fields = ('fresh_dims',)
     induced: V
     inducers: Tuple[Inducer[V]]
+    fresh_dims: DimSet
+
+    @staticmethod
+    def normalized(induced, inducers, fresh_dims=0):
+        # X ? A and X ? B together are X ? (A n B), with A u B fresh
+        filtered = {}
+        for i in inducers:
+            filtered[i.dim_set_var] = filtered.get(i.dim_set_var, i.filtered_dims) & i.filtered_dims
+            fresh_dims |= i.filtered_dims
+        inducers = tuple(Inducer(v, filtered[v]) for v in sorted(filtered, key=var_key))
+        return induced, inducers, fresh_dims
 
     def mapped[W](self, mapping: Dict[V, W]) -> 'InducedBy[W]':
         mapped_inducers = tuple(i.mapped(mapping) for i in self.inducers)
-        return InducedBy(mapping[self.induced], mapped_inducers)
+        return InducedBy(mapping[self.induced], mapped_inducers, self.fresh_dims)
+
+    def encoded(self, encode_var) -> list:
+        encoded = ["induced_by", encode_var(self.induced), sorted(i.encoded(encode_var) for i in self.inducers)]
+        if self.fresh_dims != self.filtered_anywhere():
+            encoded.append(sorted(dim_table.dim_set_names(self.fresh_dims)))
+        return encoded
+
+    def filtered_anywhere(self) -> DimSet:
+        filtered = 0
+        for i in self.inducers:
+            filtered |= i.filtered_dims
+        return filtered
     
     def inducer_vars(self):
         return set(i.dim_set_var for i in self.inducers)
 
+    def subsumes(self, other: 'InducedBy[V]') -> bool:
+        # both are normalized, so inducers over the same variables line up
+        return (
+            self.induced is other.induced
+            and len(self.inducers) == len(other.inducers)
+            and all(
+                i.dim_set_var is j.dim_set_var and is_subset(i.filtered_dims, j.filtered_dims)
+                for i, j in zip(self.inducers, other.inducers)
+            )
+            and is_subset(self.fresh_dims, other.fresh_dims)
+        )
+
     
     def __str__(self):
         inducers_str = ",".join(str(i) for i in self.inducers)
         if len(self.inducers) == 1:
-            return f"{self.induced} <== {inducers_str}"
-        return f"{self.induced} <== Union({inducers_str})"
+            induction = f"{self.induced} <== {inducers_str}"
+        else:
+            induction = f"{self.induced} <== Union({inducers_str})"
+        if self.fresh_dims != self.filtered_anywhere():
+            induction += f" with {{{dim_table.dim_set_str(self.fresh_dims)}}} fresh"
+        return induction
 
 # a depends on everything from X except explicitly removed dims
 # a -> X
-@dataclass(frozen=True)
 class DependsOn[V](IndirectConstraint):
-    dim: Dim
+    __slots__ = ('dim', 'dim_set_var', 'filtered_dims')
+    dim_fields = ('dim',)
+    dim_set_fields = ('filtered_dims',)
+    dim: DimId
     dim_set_var: V
-    filtered_dims: Tuple[Dim]
+    filtered_dims: DimSet
 
     def mapped[W](self, mapping: Dict[V, W]) -> 'InducedBy[W]':
         return DependsOn(self.dim, mapping[self.dim_set_var], self.filtered_dims)
 
+    def encoded(self, encode_var) -> list:
+        return [
+            "depends_on",
+            dim_table.name(self.dim),
+            encode_var(self.dim_set_var),
+            sorted(dim_table.dim_set_names(self.filtered_dims)),
+        ]
+
     def __str__(self):
-        filtered_dims_str = ",".join(str(d) for d in self.filtered_dims)
-        if len(self.filtered_dims) == 0:
-            return f"{self.dim} -> {self.dim_set_var}"
+        dim_str = dim_table.name(self.dim)
+        if self.filtered_dims == 0:
+            return f"{dim_str} -> {self.dim_set_var}"
         else:
-            return f"{self.dim} -> {self.dim_set_var} ? {{{filtered_dims_str}}}"
+            filtered_dims_str = dim_table.dim_set_str(self.filtered_dims)
+            return f"{dim_str} -> {self.dim_set_var} ? {{{filtered_dims_str}}}"
             
 
+def decode_constraint(data: list, decode_var):
+    kind, *args = data
+    if kind == "in_union":
+        dim, dim_set_vars = args
+        return InUnion(dim_table.intern(dim), tuple(decode_var(v) for v in dim_set_vars))
+    elif kind == "not_in":
+        dim, dim_set_var = args
+        return NotIn(dim_table.intern(dim), decode_var(dim_set_var))
+    elif kind == "equal":
+        lhs, rhs = args
+        return Equal(decode_var(lhs), decode_var(rhs))
+    elif kind == "induced_by":
+        induced, inducers, *fresh = args
+        return InducedBy(
+            decode_var(induced),
+            tuple(Inducer(decode_var(v), dim_table.dim_set(dims)) for v, dims in inducers),
+            dim_table.dim_set(fresh[0]) if fresh else 0,
+        )
+    elif kind == "depends_on":
+        dim, dim_set_var, dims = args
+        return DependsOn(dim_table.intern(dim), decode_var(dim_set_var), dim_table.dim_set(dims))
+    raise ValueError(f"Unknown constraint kind: {kind}")
+
 @dataclass
 class BlockTy:
     in_dim_vars: List[DimSetVar]
     out_dim_vars: List[DimSetVar]
     direct_constraints: Set[DirectConstraint[DimSetVar]]
     indirect_constraints: Set[IndirectConstraint[DimSetVar]]
+    _template: Optional['BlockTyTemplate'] = field(default=None, init=False, repr=False, compare=False)
+    # what ran out if a Budget stopped inference early, the constraints are then only a sound subset
+    incomplete: Optional[str] = field(default=None, compare=False)
+    # facts and new facts after every saturation round
+    growth: List[Tuple[int, int]] = field(default_factory=list, repr=False, compare=False)
+
+    def template(self) -> 'BlockTyTemplate':
+        if self._template is None:
+            self._template = BlockTyTemplate(self)
+        return self._template
+
+    def encoded(self) -> dict:
+        # variables are replaced by their position in the interface,
+        # so the result does not depend on vertex identity or dim ids
+        slots = (
+            {v: ["in", i] for i, v in enumerate(self.in_dim_vars)}
+            | {v: ["out", i] for i, v in enumerate(self.out_dim_vars)}
+        )
+        return {
+            "direct": sorted((c.encoded(slots.__getitem__) for c in self.direct_constraints), key=json.dumps),
+            "indirect": sorted((c.encoded(slots.__getitem__) for c in self.indirect_constraints), key=json.dumps),
+        }
+
+    @staticmethod
+    def decoded(data: dict, in_dim_vars: List[DimSetVar], out_dim_vars: List[DimSetVar]) -> 'BlockTy':
+        slots = {"in": in_dim_vars, "out": out_dim_vars}
+
+        def decode_var(slot):
+            side, index = slot
+            return slots[side][index]
+
+        return BlockTy(
+            list(in_dim_vars),
+            list(out_dim_vars),
+            {decode_constraint(c, decode_var) for c in data["direct"]},
+            {decode_constraint(c, decode_var) for c in data["indirect"]},
+        )
+
+class BlockTyTemplate:
+    """
+    A BlockTy compiled once for instantiating it at many blocks. The
+    variables of its constraints are replaced by positions in the
+    interface and kept in one integer array, so the variables of all
+    instances are looked up in a single gather. Instances that end up
+    over the same variables share one constraint object.
+    """
+
+    def __init__(self, block_ty: BlockTy):
+        interface = list(block_ty.in_dim_vars) + list(block_ty.out_dim_vars)
+        position = {v: i for i, v in enumerate(interface)}
+        self.equalities = []
+        self.constraints = []
+        columns = []
+        for c in chain(block_ty.direct_constraints, block_ty.indirect_constraints):
+            if isinstance(c, Equal):
+                self.equalities.append((position[c.lhs], position[c.rhs]))
+                continue
+            c_vars = sorted(constraint_vars(c), key=var_key)
+            self.constraints.append((c, c_vars, slice(len(columns), len(columns) + len(c_vars))))
+            columns.extend(position[v] for v in c_vars)
+        self.columns = np.array(columns, dtype=np.intp)
+
+    def instantiate(self, ports, vertices) -> Tuple[List[DirectConstraint | IndirectConstraint], 'np.ndarray']:
+        """
+        `ports` has a row per block with the ids of the variables its
+        interface is mapped to, `vertices` is the variable of every id.
+        Returns the distinct instantiated constraints and, per block,
+        the indices of its constraints among them.
+        """
+        slots = ports[:, self.columns]
+        facts = []
+        per_block = np.empty((len(ports), len(self.constraints)), dtype=np.intp)
+        for k, (c, c_vars, columns) in enumerate(self.constraints):
+            rows, inverse = np.unique(slots[:, columns], axis=0, return_inverse=True)
+            per_block[:, k] = len(facts) + inverse.reshape(-1)
+            facts.extend(
+                c.mapped(dict(zip(c_vars, (vertices[i] for i in row))))
+                for row in rows.tolist()
+            )
+        return facts, per_block
 
 class Vertex:
+    __slots__ = ('name_root', 'index')
     next_index = 0
 
     def __init__(self, name_root):
@@ -140,7 +460,8 @@ class Vertex:
         return f'{self.name_root}{self.index}'
 
     def __hash__(self):
-        return id(self)
+        # indices are dense and unique, so they hash cheaper than id()
+        return self.index
 
 class BlockSchema:
     in_vertices: List[Vertex]
@@ -169,6 +490,12 @@ class Block:
 
 type Typing = Dict[BlockSchema, BlockTy]
 
+def var_key(v):
+    # canonical order of dim set variables inside a constraint
+    if isinstance(v, Vertex):
+        return 0, v.index
+    return 1, str(v)
+
 def builtin_schema(in_count: int, out_count: int) -> BlockSchema:
     in_vertices = [Vertex.input() for _ in range(in_count)]
     out_vertices = [Vertex.output() for _ in range(out_count)]
@@ -177,39 +504,377 @@ def builtin_schema(in_count: int, out_count: int) -> BlockSchema:
 def union_type(in_count: int) -> BlockTy:
     in_dim_set_vars = [f"d_in_{i}" for i in range(in_count)]
     out_dim_set_var = "d_out"
-    inducers = [Inducer(d, tuple()) for d in in_dim_set_vars]
+    inducers = [Inducer(d, 0) for d in in_dim_set_vars]
     constraints = [InducedBy(out_dim_set_var, tuple(inducers))]
     return BlockTy(in_dim_set_vars, [out_dim_set_var], [], constraints)
 
 def remove_dim_type(dim: Dim) -> BlockTy:
+    dim = dim_table.intern(dim)
     in_dim_set_var = "d_in"
     out_dim_set_var = "d_out"
     in_constraint = InUnion(dim, (in_dim_set_var, ))
     out_constraint = NotIn(dim, out_dim_set_var)
     direct_constraints = [in_constraint, out_constraint]
-    indirect_constraints = [InducedBy(out_dim_set_var, (Inducer(in_dim_set_var, (dim,)),) )]
+    indirect_constraints = [InducedBy(out_dim_set_var, (Inducer(in_dim_set_var, 1 << dim),) )]
     return BlockTy([in_dim_set_var], [out_dim_set_var], direct_constraints, indirect_constraints)
 
 def add_fresh_dim_type(dim: Dim) -> BlockTy:
+    dim = dim_table.intern(dim)
     in_dim_set_var = "d_in"
     out_dim_set_var = "d_out"
     in_constraints = [InUnion(dim, (out_dim_set_var, )), NotIn(dim, in_dim_set_var)]
-    dependency_constraint = DependsOn(dim, in_dim_set_var, tuple())
-    induction_constraint = InducedBy(out_dim_set_var, (Inducer(in_dim_set_var, (dim, ) ),))
+    dependency_constraint = DependsOn(dim, in_dim_set_var, 0)
+    induction_constraint = InducedBy(out_dim_set_var, (Inducer(in_dim_set_var, 1 << dim),))
     indirect_constraints = [dependency_constraint, induction_constraint]
     return BlockTy([in_dim_set_var], [out_dim_set_var], in_constraints, indirect_constraints)
 
 
 
-def infer_types(schema: BlockSchema, typing: Typing) -> BlockTy:
+class InferenceObserver:
+    """
+    Receives progress events from infer_types. Every event does nothing
+    here, so observers override only the ones they need. Without an
+    observer the events are never built and rules are not timed.
+    """
+
+    def schema_started(self, schema: BlockSchema):
+        pass
+
+    def facts(self, stage: str, facts: Set):
+        # stage is "before" and "after" saturation, then "relevant" for the interface
+        pass
+
+    def iteration(self, number: int, facts: int, new_facts: int, rules: Dict[str, List]):
+        # rules maps the name of every rule fired in the round to [firings, seconds]
+        pass
+
+    def schema_finished(self, schema: BlockSchema, block_ty: BlockTy, seconds: float):
+        pass
+
+class PrintingObserver(InferenceObserver):
+    # prints the facts of every stage, as inference used to
+    titles = {"before": "facts before:", "after": "facts after", "relevant": "relevant facts"}
+
+    def facts(self, stage, facts):
+        print(self.titles[stage])
+        for f in facts:
+            print(f)
+        print()
+
+class JsonLinesObserver(InferenceObserver):
+    """
+    Writes every event to `stream` as one JSON object per line and sums up
+    rule firings and schema times for `summary`. Schemas are numbered in
+    the order they are started.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.schema_ids = {}
+        self.current = None
+        self.rules = defaultdict(lambda: [0, 0.0])
+        # schema number, iterations, peak facts, seconds
+        self.schemas = []
+        self.iterations = 0
+        self.peak_facts = 0
+
+    def write(self, event, **fields):
+        self.stream.write(json.dumps({"event": event, "schema": self.current, **fields}) + "\n")
+
+    def schema_started(self, schema):
+        self.current = self.schema_ids.setdefault(schema, len(self.schema_ids))
+        self.iterations = 0
+        self.peak_facts = 0
+        self.write("schema_started", blocks=len(schema.blocks))
+
+    def facts(self, stage, facts):
+        self.peak_facts = max(self.peak_facts, len(facts))
+        self.write("facts", stage=stage, count=len(facts))
+
+    def iteration(self, number, facts, new_facts, rules):
+        self.iterations += 1
+        self.peak_facts = max(self.peak_facts, facts)
+        for name, (firings, seconds) in rules.items():
+            self.rules[name][0] += firings
+            self.rules[name][1] += seconds
+        self.write(
+            "iteration",
+            iteration=number,
+            facts=facts,
+            new_facts=new_facts,
+            rules={name: {"firings": firings, "seconds": seconds} for name, (firings, seconds) in rules.items()},
+        )
+
+    def schema_finished(self, schema, block_ty, seconds):
+        self.schemas.append((self.current, self.iterations, self.peak_facts, seconds))
+        self.write(
+            "schema_finished",
+            seconds=seconds,
+            direct=len(block_ty.direct_constraints),
+            indirect=len(block_ty.indirect_constraints),
+        )
+
+    def summary(self) -> str:
+        # rules and schemas, the most expensive first
+        lines = [f"{'rule':<32}{'firings':>10}{'seconds':>12}"]
+        for name, (firings, seconds) in sorted(self.rules.items(), key=lambda r: -r[1][1]):
+            lines.append(f"{name:<32}{firings:>10}{seconds:>12.4f}")
+        lines.append("")
+        lines.append(f"{'schema':<8}{'iterations':>12}{'peak facts':>12}{'seconds':>12}")
+        for number, iterations, peak_facts, seconds in sorted(self.schemas, key=lambda s: -s[3]):
+            lines.append(f"{number:<8}{iterations:>12}{peak_facts:>12}{seconds:>12.4f}")
+        return "\n".join(lines)
+
+def resident_memory() -> int:
+    # bytes of resident memory of the process, from /proc where there is one
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        # peak rather than current, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@dataclass
+class Budget:
+    """
+    Limits for infer_types. max_iterations and max_facts bound the
+    saturation of every schema, max_seconds and max_memory (resident bytes)
+    the whole call. Only rounds that derive new facts count. Saturation
+    stops after the round exceeding one of them, and the types built from
+    the facts derived so far are marked incomplete.
+    """
+    max_iterations: Optional[int] = None
+    max_facts: Optional[int] = None
+    max_seconds: Optional[float] = None
+    max_memory: Optional[int] = None
+    # time.monotonic() when the call started, shared by its worker processes
+    started_at: Optional[float] = field(default=None, compare=False)
+
+    def started(self) -> 'Budget':
+        if self.started_at is not None:
+            return self
+        return replace(self, started_at=time.monotonic())
+
+class BudgetUsage:
+    # rounds of saturating one schema, against a started Budget
+
+    def __init__(self, budget: Budget):
+        self.budget = budget
+        self.iterations = 0
+        self.growth = []
+        self.exceeded: Optional[str] = None
+
+    def spend(self, facts: int, new_facts: int) -> bool:
+        # records a round that derived new facts, false once saturation has to stop
+        budget = self.budget
+        self.iterations += 1
+        self.growth.append((facts, new_facts))
+        if budget.max_iterations is not None and self.iterations > budget.max_iterations:
+            self.exceeded = "max_iterations"
+        elif budget.max_facts is not None and facts > budget.max_facts:
+            self.exceeded = "max_facts"
+        elif budget.max_seconds is not None and time.monotonic() - budget.started_at > budget.max_seconds:
+            self.exceeded = "max_seconds"
+        elif budget.max_memory is not None and resident_memory() > budget.max_memory:
+            self.exceeded = "max_memory"
+        return self.exceeded is None
+
+def infer_types(
+        schema: BlockSchema,
+        typing: Typing,
+        semi_naive: bool = True,
+        goal_directed: bool = False,
+        cache: Optional['BlockTyCache'] = None,
+        vectorized: bool = False,
+        observer: Optional['InferenceObserver'] = None,
+        budget: Optional[Budget] = None,
+) -> BlockTy:
+    """
+    Types `schema` and every untyped schema it uses, storing them in `typing`.
+    Schemas are grouped into strongly connected components and typed
+    sub-schemas first. Mutually recursive schemas are solved together
+    by solve_recursive. Progress is reported to `observer`, if given.
+    """
     if schema in typing:
         return typing[schema]
+    if budget is not None:
+        budget = budget.started()
+
+    # schema hashes, shared by all the schemas typed here
+    hashes = {}
+    untyped_subs = lambda s: [b.schema for b in s.blocks if b.schema not in typing]
+    for component in strongly_connected_components(schema, untyped_subs):
+        if is_recursive(component):
+            solve_recursive(component, typing, semi_naive, goal_directed, vectorized, observer, budget)
+        else:
+            s, = component
+            typing[s] = infer_schema(
+                s, typing, semi_naive, goal_directed, cache, vectorized, observer, budget, hashes,
+            )
+    return typing[schema]
+
+def strongly_connected_components(root: BlockSchema, successors) -> List[List[BlockSchema]]:
+    # Tarjan's algorithm without recursion, components come out sub-schemas first
+    index = {root: 0}
+    low = {root: 0}
+    stack = [root]
+    on_stack = {root}
+    components = []
+    work = [(root, iter(successors(root)))]
+    while work:
+        v, children = work[-1]
+        for w in children:
+            if w not in index:
+                index[w] = low[w] = len(index)
+                stack.append(w)
+                on_stack.add(w)
+                work.append((w, iter(successors(w))))
+                break
+            elif w in on_stack:
+                low[v] = min(low[v], index[w])
+        else:
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+            if low[v] == index[v]:
+                component = []
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    component.append(w)
+                    if w is v:
+                        break
+                components.append(component)
+    return components
+
+def is_recursive(component: List[BlockSchema]) -> bool:
+    return len(component) > 1 or any(b.schema is component[0] for b in component[0].blocks)
+
+def solve_recursive(
+        component: List[BlockSchema],
+        typing: Typing,
+        semi_naive: bool,
+        goal_directed: bool,
+        vectorized: bool = False,
+        observer: Optional['InferenceObserver'] = None,
+        budget: Optional[Budget] = None,
+):
+    """
+    Shared fixpoint for mutually recursive schemas. Every schema starts
+    with the empty type and all of them are re-inferred until no type
+    changes. There are finitely many facts over the interface of a schema,
+    so this stops. The types are the least ones consistent with the
+    definitions, e.g. a recursive call contributes no induction by itself.
+    """
+    for s in component:
+        typing[s] = BlockTy(s.in_vertices, s.out_vertices, set(), set())
+    changed = True
+    while changed:
+        changed = False
+        for s in component:
+            block_ty = infer_schema(
+                s, typing, semi_naive, goal_directed, vectorized=vectorized, observer=observer, budget=budget,
+            )
+            if block_ty.encoded() != typing[s].encoded() or block_ty.incomplete:
+                typing[s] = block_ty
+                changed = True
+        # partial types need not converge
+        if any(typing[s].incomplete for s in component):
+            break
+
+def infer_schema(
+        schema: BlockSchema,
+        typing: Typing,
+        semi_naive: bool = True,
+        goal_directed: bool = False,
+        cache: Optional['BlockTyCache'] = None,
+        vectorized: bool = False,
+        observer: Optional['InferenceObserver'] = None,
+        budget: Optional[Budget] = None,
+        hashes: Optional[dict] = None,
+) -> BlockTy:
+    # infers the type of a single schema whose sub-schemas are all typed,
+    # `hashes` is the schema_hash memo of the surrounding infer_types
+    started = time.perf_counter()
+    if observer is not None:
+        observer.schema_started(schema)
+    key = schema_hash(schema, typing, goal_directed, vectorized, hashes) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            block_ty = BlockTy.decoded(cached, schema.in_vertices, schema.out_vertices)
+            if observer is not None:
+                observer.schema_finished(schema, block_ty, time.perf_counter() - started)
+            return block_ty
     
-    facts = set()
+    # links only ever produce equalities, so instead of Equal facts
+    # every variable is replaced by the representative of its class
+    classes = EquivalenceClasses()
+    for source, destinations in schema.edges.items():
+        for destination in destinations:
+            classes.union(source, destination)
+    if np is None:
+        block_facts = instantiate_blocks_one_by_one(schema.blocks, typing, classes)
+    else:
+        block_facts = instantiate_blocks(schema.blocks, typing, classes, per_block=goal_directed)
+
+    if observer is not None:
+        observer.facts("before", set().union(*block_facts))
+
+    usage = None if budget is None else BudgetUsage(budget)
+    relevant_vertices = schema.in_vertices + schema.out_vertices
+    if goal_directed:
+        facts = goal_directed_saturate(
+            block_facts,
+            [classes.find(v) for v in schema.in_vertices],
+            {classes.find(v) for v in relevant_vertices},
+            observer,
+            usage,
+        )
+    elif vectorized:
+        facts = vectorized_saturate(
+            set().union(*block_facts), {classes.find(v) for v in relevant_vertices}, observer, usage,
+        )
+    else:
+        facts = saturate(set().union(*block_facts), semi_naive, observer, usage)
+    if observer is not None:
+        observer.facts("after", facts)
     
-    for block in schema.blocks:
-        if block.schema not in typing:
-            typing[block.schema] = infer_types(block.schema, typing)
+    relevant_facts = set()
+    relevant_members = defaultdict(list)
+    for v in relevant_vertices:
+        relevant_members[classes.find(v)].append(v)
+    for f in facts:
+        # a fact about a class holds for every interface vertex in it
+        reps = list(constraint_vars(f))
+        for members in product(*(relevant_members[r] for r in reps)):
+            relevant_facts.add(f.mapped(dict(zip(reps, members))))
+    if observer is not None:
+        observer.facts("relevant", relevant_facts)
+
+    incomplete = usage.exceeded if usage is not None else None
+    if incomplete is None and any(typing[b.schema].incomplete for b in schema.blocks):
+        incomplete = "sub-schema"
+    block_ty = BlockTy(
+        schema.in_vertices,
+        schema.out_vertices,
+        {f for f in relevant_facts if isinstance(f, DirectConstraint)},
+        {f for f in relevant_facts if isinstance(f, IndirectConstraint)},
+        incomplete=incomplete,
+        growth=usage.growth if usage is not None else [],
+    )
+    if key is not None and incomplete is None:
+        cache.put(key, block_ty.encoded())
+    if observer is not None:
+        observer.schema_finished(schema, block_ty, time.perf_counter() - started)
+    return block_ty
+    
+
+def instantiate_blocks_one_by_one(blocks: List[Block], typing: Typing, classes: 'EquivalenceClasses') -> List[Set]:
+    block_facts = []
+    for block in blocks:
         block_typing = typing[block.schema]
 
         dim_set_var_mapping = {
@@ -219,105 +884,594 @@ def infer_types(schema: BlockSchema, typing: Typing) -> BlockTy:
             +
             list(zip(block_typing.out_dim_vars, block.schema.out_vertices))
         }
-        for constraint in block_typing.direct_constraints:
-            facts.add(constraint.mapped(dim_set_var_mapping))
-        for constraint in block_typing.indirect_constraints:
-            facts.add(constraint.mapped(dim_set_var_mapping))
-    print('facts before:')
-    for f in facts:
-        print(f)
-
-    print()
-    for source, destinations in schema.edges.items():
-        for destination in destinations:
-            facts.add(Equal(source, destination))
-            facts.add(Equal(destination, source))
-    
+        block_facts.append(
+            [c.mapped(dim_set_var_mapping) for c in block_typing.direct_constraints]
+            + [c.mapped(dim_set_var_mapping) for c in block_typing.indirect_constraints]
+        )
+        for f in block_facts[-1]:
+            if isinstance(f, Equal):
+                classes.union(f.lhs, f.rhs)
+    return [{f.mapped(classes) for f in fs if not isinstance(f, Equal)} for fs in block_facts]
+
+def instantiate_blocks(blocks: List[Block], typing: Typing, classes: 'EquivalenceClasses', per_block: bool) -> List[Set]:
+    """
+    Instantiates the types of `blocks` over the representatives of `classes`,
+    all blocks of one schema at once from the template of its type.
+    Returns the facts of every block if `per_block`, otherwise all of them as one set.
+    """
+    groups = defaultdict(list)
+    for i, block in enumerate(blocks):
+        groups[block.schema].append(i)
+
+    ids = {}
+    vertices = []
+
+    def vertex_id(v):
+        if v not in ids:
+            ids[v] = len(vertices)
+            vertices.append(v)
+        return ids[v]
+
+    ports = {}
+    for sub, members in groups.items():
+        interface = sub.in_vertices + sub.out_vertices
+        ports[sub] = np.array(
+            [[vertex_id(blocks[i].mapping[v]) for v in interface] for i in members],
+            dtype=np.intp,
+        ).reshape(len(members), len(interface))
+        for lhs, rhs in typing[sub].template().equalities:
+            for row in ports[sub].tolist():
+                classes.union(vertices[row[lhs]], vertices[row[rhs]])
+    # representatives not yet seen get appended, the ports only use the first ids
+    representative = np.array(
+        [vertex_id(classes.find(vertices[i])) for i in range(len(vertices))],
+        dtype=np.intp,
+    )
+
+    block_facts = [set() for _ in blocks] if per_block else [set()]
+    for sub, members in groups.items():
+        facts, indices = typing[sub].template().instantiate(representative[ports[sub]], vertices)
+        if per_block:
+            for i, block_indices in zip(members, indices.tolist()):
+                block_facts[i].update(facts[k] for k in block_indices)
+        else:
+            block_facts[0].update(facts)
+    return block_facts
+
+def constraint_vars(c):
+    if isinstance(c, InUnion):
+        return set(c.dim_set_vars)
+    elif isinstance(c, (NotIn, DependsOn)):
+        return {c.dim_set_var}
+    elif isinstance(c, Equal):
+        return {c.lhs, c.rhs}
+    elif isinstance(c, InducedBy):
+        return {c.induced} | c.inducer_vars()
+
+class EquivalenceClasses:
+    """
+    Union-find over dim set variables with path compression.
+    Indexing with a variable gives the representative of its class,
+    so it can be passed to `mapped` directly.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, v):
+        root = v
+        while self.parent.get(root, root) is not root:
+            root = self.parent[root]
+        while v is not root:
+            self.parent[v], v = root, self.parent[v]
+        return root
+
+    def union(self, u, v):
+        u, v = self.find(u), self.find(v)
+        if u is v:
+            return
+        if self.size.get(u, 1) < self.size.get(v, 1):
+            u, v = v, u
+        self.parent[v] = u
+        self.size[u] = self.size.get(u, 1) + self.size.get(v, 1)
+
+    def __getitem__(self, v):
+        return self.find(v)
+
+def conclusions_of(f1, f2):
+    conclusions = apply_inference(f1, f2)
+    if type(conclusions) is not list:
+        conclusions = [conclusions]
+    return [c for c in conclusions if c is not None]
+
+def observed_conclusions(f1, f2, rules):
+    # conclusions_of, counting the firing and its time under the name of the rule
+    rule = rule_for(f1, f2)
+    if rule is None:
+        return []
+    started = time.perf_counter()
+    conclusions = conclusions_of(f1, f2)
+    stats = rules[rule.__name__]
+    stats[0] += 1
+    stats[1] += time.perf_counter() - started
+    return conclusions
+
+def saturate(facts, semi_naive=True, observer=None, usage=None):
+    if semi_naive:
+        return semi_naive_saturate(facts, observer, usage)
+    return naive_saturate(facts, observer, usage)
+
+def naive_saturate(facts, observer=None, usage=None):
+    # every round joins every fact with every other fact
+    store = FactStore(facts)
     changed = True
+    iteration = 0
     while changed:
         changed = False
-        new_facts = set()
-        for f1 in facts:
-            for f2 in facts:
-                conclusions = apply_inference(f1, f2)
-                if type(conclusions) is not list:
-                    conclusions = [conclusions]
-                
+        rules = None if observer is None else defaultdict(lambda: [0, 0.0])
+        new_facts = {}
+        for f1 in store:
+            for f2 in store:
+                conclusions = conclusions_of(f1, f2) if rules is None else observed_conclusions(f1, f2, rules)
                 for conclusion in conclusions:
-                    if conclusion is not None and conclusion not in facts:
-                        changed = True
-                        new_facts.add(conclusion)
-        facts = facts.union(new_facts)
-    
-    relevant_facts = set()
-    relevant_vertices = set(schema.in_vertices + schema.out_vertices)
-    print("facts after")
+                    if conclusion not in store:
+                        new_facts.setdefault(conclusion, (f1, f2))
+        added = 0
+        for f, premises in new_facts.items():
+            added += store.add(f, premises)
+        changed = added > 0
+        iteration += 1
+        if observer is not None:
+            observer.iteration(iteration, len(store), added, rules)
+        # a round adding nothing only confirms the fixpoint, it is not charged
+        if usage is not None and added and not usage.spend(len(store), added):
+            break
+    return set(store)
+
+def semi_naive_saturate(facts, observer=None, usage=None):
+    store = FactStore()
+    saturate_into(store, facts, observer, usage)
+    return set(store)
+
+def saturate_into(store, facts, observer=None, usage=None):
+    # stops early, leaving the facts derived so far, once usage is over budget
+    # every round joins only the facts derived in the previous round (delta)
+    # with all known facts - pairs of old facts were already joined before
+    added = [f for f in facts if store.add(f)]
+    delta = {f for f in added if f in store}
+    iteration = 0
+    while delta:
+        rules = None if observer is None else defaultdict(lambda: [0, 0.0])
+        new_facts = {}
+        for d in delta:
+            for f1, f2 in store.candidate_pairs(d):
+                conclusions = conclusions_of(f1, f2) if rules is None else observed_conclusions(f1, f2, rules)
+                for conclusion in conclusions:
+                    if conclusion not in store:
+                        new_facts.setdefault(conclusion, (f1, f2))
+        added = [f for f, premises in new_facts.items() if store.add(f, premises)]
+        # a fact may have been subsumed by one added after it
+        delta = {f for f in added if f in store}
+        iteration += 1
+        if observer is not None:
+            observer.iteration(iteration, len(store), len(added), rules)
+        # a round adding nothing only confirms the fixpoint, it is not charged
+        if usage is not None and added and not usage.spend(len(store), len(added)):
+            return
+
+def goal_directed_saturate(block_facts, in_vars, interface_vars, observer=None, usage=None):
+    """
+    Adds the facts of blocks one at a time, sweeping from the inputs,
+    and eliminates an internal variable once every block touching it has
+    been added, if can_eliminate allows it. By then all facts that go
+    through the variable have been short-circuited by the rules, so the
+    facts mentioning it are dropped. Variables that cannot be eliminated
+    are kept to the end, as in full saturation.
+
+    The facts about the interface and the contradictions found are those
+    of the full closure, up to facts implied by stronger ones.
+    """
+    block_vars = [set().union(*(constraint_vars(f) for f in fs)) for fs in block_facts]
+    blocks_touching = defaultdict(list)
+    for i, vs in enumerate(block_vars):
+        for v in vs:
+            blocks_touching[v].append(i)
+    pending = {v: len(bs) for v, bs in blocks_touching.items()}
+
+    store = FactStore()
+    for i in sweep_order(block_vars, blocks_touching, in_vars):
+        saturate_into(store, block_facts[i], observer, usage)
+        if usage is not None and usage.exceeded:
+            break
+        for v in block_vars[i]:
+            pending[v] -= 1
+            if pending[v] == 0 and v not in interface_vars and can_eliminate(store, v, pending):
+                for f in store.facts_about(v):
+                    store.remove(f)
+    return set(store)
+
+def can_eliminate(store, v, pending) -> bool:
+    # Facts that later blocks derive about the neighbours of v still flow
+    # along the short-circuits around v, unless they would have stopped at
+    # v, or met a fact about v there. A dim a stops at v, i.e. goes no further
+    # towards the inducers of v, if:
+    #   a not in Y, Y <== v ? B with a not in B, and a filtered into v
+    #   a in Y, Y <== v ? B with a not fresh in Y, and a fresh in v
+    # Both are ruled out if what is filtered into v is filtered out of it
+    # again, and what may be fresh in v is fresh past it.
+    if any(len(f.dim_set_vars) > 1 for f in store.in_union_by_var[v]):
+        # a in Union(v, W) meets a not in W, which may come later
+        return False
+    filtered_in = 0
+    fresh_in = 0
+    for f in store.induced_by_induced[v]:
+        if any(pending[u] for u in f.inducer_vars()):
+            # paths into v that meet again further up are merged only
+            # once they are complete, a -> v must see the merged ones
+            return False
+        filtered_in |= f.filtered_anywhere()
+        fresh_in |= f.fresh_dims
+    for f in store.induced_by_inducer[v]:
+        filtered_out, = (i.filtered_dims for i in f.inducers if i.dim_set_var is v)
+        if not is_subset(filtered_in, filtered_out) or not is_subset(fresh_in, f.fresh_dims):
+            return False
+    return True
+
+def vectorized_saturate(facts, interface_vars, observer=None, usage=None):
+    """
+    Saturation that closes the induction graph with NumPy instead of
+    firing the rules along InducedBy chains one pair at a time.
+
+    Every inducer X ? A of Y is an edge Y -> X, present in the layer of
+    every dim not in A, and the filtered closure is the transitive closure
+    of each layer. Dims that are filtered nowhere share the last layer.
+    InducedBy, NotIn and DependsOn only ever follow from InducedBy facts,
+    so they are emitted straight from the closure, leaving only the
+    InUnion rules for the rule engine.
+
+    Inductions are emitted over the variables nothing induces, and over
+    those and the interface. A dim in a union of other variables only
+    reaches the variables they induce together through inductions over
+    them, so it is put there straight from the closure over them. The
+    types and the contradictions are those of the rules, up to facts
+    implied by stronger ones. Cyclic inductions are saturated with the
+    rules instead.
+    """
+    if np is None:
+        raise ImportError("vectorized saturation needs numpy")
+    induced_by = [f for f in facts if isinstance(f, InducedBy)]
+    if not induced_by:
+        return semi_naive_saturate(facts, observer, usage)
+    variables = sorted(set().union(*(constraint_vars(f) for f in induced_by)), key=var_key)
+    index = {v: i for i, v in enumerate(variables)}
+    n = len(variables)
+
+    universe = 0
+    for f in induced_by:
+        for i in f.inducers:
+            universe |= i.filtered_dims
     for f in facts:
-        print(f)
-        if isinstance(f, InducedBy):
-            if f.induced in relevant_vertices and all(d in relevant_vertices for d in f.inducer_vars()):
-                relevant_facts.add(f)
-        elif isinstance(f, NotIn):
-            if f.dim_set_var in relevant_vertices:
-                relevant_facts.add(f)
-        elif isinstance(f, InUnion):
-            if all(d in relevant_vertices for d in f.dim_set_vars):
-                relevant_facts.add(f)
-        elif isinstance(f, DependsOn):
-            if f.dim_set_var in relevant_vertices:
-                relevant_facts.add(f)
-
-
-    print()
-    print("relevant facts")
-    for f in relevant_facts:
-        print(f)
-
-
-    print()
-    
+        if isinstance(f, DependsOn):
+            universe |= f.filtered_dims
+    layers = list(dims_of(universe))
+    layer_of = {d: k for k, d in enumerate(layers)}
+    free = len(layers)
+
+    def passing(filtered_dims):
+        # layers a filter lets through, the free one always
+        return np.array([not has_dim(filtered_dims, d) for d in layers] + [True])
+
+    def filter_of(column):
+        # dims of the layers in which there is no path
+        return sum(1 << layers[k] for k in np.flatnonzero(~column[:free]))
+
+    edges = np.zeros((free + 1, n, n), dtype=bool)
+    fresh = [0] * n
+    for f in induced_by:
+        fresh[index[f.induced]] |= f.fresh_dims
+        for i in f.inducers:
+            edges[passing(i.filtered_dims), index[f.induced], index[i.dim_set_var]] = True
+    reach = transitive_closure(edges)
+    if reach[free].diagonal().any():
+        return semi_naive_saturate(facts, observer, usage)
+
+    leaves = ~edges[free].any(axis=1)
+
+    def paths_to(cut):
+        # paths may only stop at, not go through, variables of the cut
+        through = edges & ~cut[None, :, None]
+        return edges | (bool_matmul(edges, transitive_closure(through)))
+
+    derived = []
+    interface = np.array([v in interface_vars for v in variables], dtype=bool)
+    for cut in (leaves, leaves | interface):
+        paths = paths_to(cut)
+        for y in np.flatnonzero(~leaves):
+            targets = np.flatnonzero(paths[free, y] & cut)
+            # dims fresh anywhere on the way may be fresh in y
+            fresh_dims = fresh[y]
+            for z in np.flatnonzero(paths[free, y] & ~cut):
+                fresh_dims |= fresh[z]
+            derived.append(InducedBy(
+                variables[y],
+                tuple(Inducer(variables[x], filter_of(paths[:, y, x])) for x in targets),
+                fresh_dims,
+            ))
+
+    for f in facts:
+        if isinstance(f, NotIn) and f.dim_set_var in index:
+            layer = layer_of.get(f.dim, free)
+            for x in np.flatnonzero(reach[layer, index[f.dim_set_var]]):
+                derived.append(NotIn(f.dim, variables[x]))
+
+    for f in facts:
+        if isinstance(f, DependsOn) and f.dim_set_var in index:
+            # one per fact, as the rules never merge dependencies on the same dim
+            reached = reach[:, index[f.dim_set_var]] & passing(f.filtered_dims)[:, None]
+            for x in np.flatnonzero(reached[free]):
+                derived.append(DependsOn(f.dim, variables[x], filter_of(reached[:, x])))
+
+    store = FactStore(f for f in chain(facts, derived) if not isinstance(f, InUnion))
+    new_facts = [f for f in facts if isinstance(f, InUnion)]
+    paths_by_union = {}
+    while new_facts:
+        saturate_into(store, new_facts, observer, usage)
+        if usage is not None and usage.exceeded:
+            break
+        new_facts = []
+        for f in list(store.by_kind[InUnion]):
+            if len(f.dim_set_vars) < 2 or not all(v in index for v in f.dim_set_vars):
+                continue
+            # a in Union(X_1, ..., X_k) gives a in Y if Y <== Union(X_1 ? A_1, ..., X_k ? A_k, ...)
+            # without a in any A_i, the other inducers of Y being the variables nothing induces
+            union = tuple(sorted(index[v] for v in f.dim_set_vars))
+            if union not in paths_by_union:
+                cut = leaves.copy()
+                cut[list(union)] = True
+                paths_by_union[union] = paths_to(cut)
+            paths = paths_by_union[union][layer_of.get(f.dim, free)]
+            for y in np.flatnonzero(paths[:, list(union)].all(axis=1)):
+                conclusion = InUnion(f.dim, (variables[y],))
+                if conclusion not in store:
+                    new_facts.append(conclusion)
+    return set(store)
+
+def bool_matmul(lhs, rhs):
+    # through float32 so that it runs on BLAS, counts of paths stay exact
+    return np.matmul(lhs.astype(np.float32), rhs.astype(np.float32)) > 0
+
+def transitive_closure(edges):
+    # squaring doubles the length of the paths covered, on every layer at once
+    reach = edges
+    while True:
+        longer = reach | bool_matmul(reach, reach)
+        if (longer == reach).all():
+            return reach
+        reach = longer
+
+def sweep_order(block_vars, blocks_touching, start_vars):
+    # breadth first over blocks sharing variables, starting at the inputs
+    order = []
+    visited = set()
+    queue = deque(i for v in start_vars for i in blocks_touching[v])
+    for start in range(len(block_vars)):
+        queue.append(start)
+        while queue:
+            i = queue.popleft()
+            if i in visited:
+                continue
+            visited.add(i)
+            order.append(i)
+            for v in block_vars[i]:
+                queue.extend(blocks_touching[v])
+    return order
+
+class Contradiction(ValueError):
+    """
+    Raised when inference finds a program unsatisfiable: a dim is required
+    in a union of variables and excluded from every one of them.
+    Carries the conflicting facts and the rule firings that derived them.
+    """
+
+    def __init__(self, facts, firings):
+        super().__init__(facts, firings)
+        self.facts = facts
+        self.firings = firings
+
+    def __str__(self):
+        lines = ["contradicting facts: " + ", ".join(str(f) for f in self.facts)]
+        for conclusion, rule, (f1, f2) in self.firings:
+            lines.append(f"  {conclusion}    by {rule} from {f1} and {f2}")
+        return "\n".join(lines)
+
+class FactStore:
+    """
+    Set of facts indexed by kind and by the dim set variables that
+    apply_inference joins on, so that a fact is only ever paired
+    with facts that can possibly match one of the rules.
+
+    An InducedBy fact is only kept if no other one subsumes it,
+    which keeps the set minimal.
+
+    Facts requiring a dim in a union of variables are checked against
+    the ones excluding it from each of them as they are added, so an
+    unsatisfiable program raises Contradiction on the first conflict.
+    """
+
+    def __init__(self, facts=()):
+        self.facts = set()
+        self.by_kind = defaultdict(set)
+        self.induced_by_induced = defaultdict(set)
+        self.induced_by_inducer = defaultdict(set)
+        self.not_in_by_var = defaultdict(set)
+        self.in_union_by_var = defaultdict(set)
+        self.depends_on_by_var = defaultdict(set)
+        # (dim, var) to the InUnion facts requiring the dim in a union with the var
+        self.required = defaultdict(set)
+        # (dim, var) to the NotIn fact excluding the dim from the var
+        self.excluded = {}
+        # derived fact to the pair of facts it was first derived from
+        self.derivations = {}
+        for f in facts:
+            self.add(f)
+
+    def __contains__(self, fact):
+        return fact in self.facts
+
+    def __iter__(self):
+        return iter(self.facts)
+
+    def __len__(self):
+        return len(self.facts)
+
+    def add(self, fact, premises=None) -> bool:
+        if fact in self.facts:
+            return False
+        if isinstance(fact, InducedBy):
+            same_induced = self.induced_by_induced[fact.induced]
+            if any(f.subsumes(fact) for f in same_induced):
+                return False
+            for f in [f for f in same_induced if fact.subsumes(f)]:
+                self.remove(f)
+        self.facts.add(fact)
+        self.by_kind[type(fact)].add(fact)
+        if isinstance(fact, InducedBy):
+            self.induced_by_induced[fact.induced].add(fact)
+            for v in fact.inducer_vars():
+                self.induced_by_inducer[v].add(fact)
+        elif isinstance(fact, NotIn):
+            self.not_in_by_var[fact.dim_set_var].add(fact)
+            self.excluded[fact.dim, fact.dim_set_var] = fact
+        elif isinstance(fact, InUnion):
+            # InUnion over no variables is keyed by None
+            for v in fact.dim_set_vars or (None,):
+                self.in_union_by_var[v].add(fact)
+                self.required[fact.dim, v].add(fact)
+        elif isinstance(fact, DependsOn):
+            self.depends_on_by_var[fact.dim_set_var].add(fact)
+        if premises is not None:
+            self.derivations[fact] = premises
+        self.check_consistent(fact)
+        return True
+
+    def remove(self, fact):
+        self.facts.discard(fact)
+        self.by_kind[type(fact)].discard(fact)
+        if isinstance(fact, InducedBy):
+            self.induced_by_induced[fact.induced].discard(fact)
+            for v in fact.inducer_vars():
+                self.induced_by_inducer[v].discard(fact)
+        elif isinstance(fact, NotIn):
+            self.not_in_by_var[fact.dim_set_var].discard(fact)
+            self.excluded.pop((fact.dim, fact.dim_set_var), None)
+        elif isinstance(fact, InUnion):
+            for v in fact.dim_set_vars or (None,):
+                self.in_union_by_var[v].discard(fact)
+                self.required[fact.dim, v].discard(fact)
+        elif isinstance(fact, DependsOn):
+            self.depends_on_by_var[fact.dim_set_var].discard(fact)
+        self.derivations.pop(fact, None)
+
+    def check_consistent(self, fact):
+        if isinstance(fact, InUnion):
+            candidates = [fact]
+        elif isinstance(fact, NotIn):
+            candidates = self.required[fact.dim, fact.dim_set_var]
+        else:
+            return
+        for in_union in candidates:
+            # a in Union(X_1, ..., X_n) and a not in X_i for every i
+            not_ins = [self.excluded.get((in_union.dim, v)) for v in in_union.dim_set_vars]
+            if all(not_ins):
+                conflict = [in_union] + not_ins
+                raise Contradiction(conflict, self.firings(conflict))
+
+    def firings(self, facts) -> List[Tuple[Any, str, Tuple[Any, Any]]]:
+        # rule firings deriving `facts`, each after the ones deriving its premises
+        order = []
+        visited = set()
+        for root in facts:
+            stack = [(root, False)]
+            while stack:
+                f, expanded = stack.pop()
+                if expanded:
+                    f1, f2 = self.derivations[f]
+                    order.append((f, rule_for(f1, f2).__name__, (f1, f2)))
+                elif f not in visited:
+                    visited.add(f)
+                    if f in self.derivations:
+                        stack.append((f, True))
+                        stack.extend((p, False) for p in self.derivations[f])
+        return order
+
+    def facts_about(self, v):
+        return (
+            self.induced_by_induced[v]
+            | self.induced_by_inducer[v]
+            | self.not_in_by_var[v]
+            | self.in_union_by_var[v]
+            | self.depends_on_by_var[v]
+        )
+
+    def candidate_pairs(self, fact):
+        """
+        Ordered pairs (f1, f2) containing `fact` on either side for which
+        apply_inference(f1, f2) may derive something
+        """
+        for f2 in self.partners_after(fact):
+            yield fact, f2
+        for f1 in self.partners_before(fact):
+            yield f1, fact
+
+    def partners_after(self, f1):
+        # facts f2 such that (f1, f2) matches a rule
+        partners = set()
+        if isinstance(f1, InducedBy):
+            for v in f1.inducer_vars():
+                partners |= self.induced_by_induced[v]
+                partners |= self.in_union_by_var[v]
+            partners |= self.not_in_by_var[f1.induced]
+            partners |= self.in_union_by_var[f1.induced]
+            partners |= self.in_union_by_var[None]
+            partners |= self.depends_on_by_var[f1.induced]
+        return partners
+
+    def partners_before(self, f2):
+        # facts f1 such that (f1, f2) matches a rule
+        partners = set()
+        if isinstance(f2, InducedBy):
+            partners |= self.induced_by_inducer[f2.induced]
+        elif isinstance(f2, (NotIn, DependsOn)):
+            partners |= self.induced_by_induced[f2.dim_set_var]
+        elif isinstance(f2, InUnion):
+            for v in f2.dim_set_vars:
+                partners |= self.induced_by_induced[v]
+                partners |= self.induced_by_inducer[v]
+            if not f2.dim_set_vars:
+                partners |= self.by_kind[InducedBy]
+        return partners
 
 def apply_inference(f1, f2):
-    if isinstance(f1, Equal):
-        if isinstance(f2, Equal) and f1.rhs is f2.lhs and f1.lhs is not f2.rhs:
-            print("VERY SUS")
-            print(f1.lhs, f2.rhs)
-            return Equal(f1.lhs, f2.rhs)
-        elif isinstance(f2, InducedBy) and f1.rhs is f2.induced:
-            #   X = Y       Y <== Union(X_1 ? A_1,...,X_n ? A_n)
-            #  --------------------------------------------
-            #          X <== Union(X_1 ? A_1,...,X_n ? A_n) 
-            return InducedBy(f1.lhs, f2.inducers)
-        elif isinstance(f2, InducedBy) and f1.lhs in f2.inducer_vars():
-            #   X = Y       Z <== Union(X, X_1,...,X_n) ? A
-            #  --------------------------------------------
-            #          Z <== Union(Y, X_1,...,X_n) ? A
-            inducers = {i.dim_set_var:i.filtered_dims for i in f2.inducers}
-            inducers[f1.rhs] = inducers[f1.lhs]
-            del inducers[f1.lhs]
-            inducers = tuple(Inducer(d, f) for d, f in inducers.items())
-            return InducedBy(f2.induced, tuple(inducers))
-        elif isinstance(f2, NotIn) and f1.lhs is f2.dim_set_var:
-            return NotIn(f2.dim, f1.rhs)
-        elif isinstance(f2, InUnion) and f1.lhs in f2.dim_set_vars:
-            dim_set_vars = set(f2.dim_set_vars)
-            dim_set_vars.remove(f1.lhs)
-            dim_set_vars.add(f1.rhs)
-            return InUnion(f2.dim, tuple(dim_set_vars))
-        elif isinstance(f2, DependsOn) and f1.lhs is f2.dim_set_var:
-            return DependsOn(f2.dim, f1.rhs, f2.filtered_dims)
-
-    elif isinstance(f1, InducedBy) and isinstance(f2, InducedBy) and f2.induced in f1.inducer_vars():
-        return infer_transitive_induction(f1, f2)
+    rule = rule_for(f1, f2)
+    if rule is None:
+        return None
+    return rule(f1, f2)
+
+def rule_for(f1, f2):
+    # equalities are resolved by EquivalenceClasses before saturation,
+    # so only rules on the induction of variables remain
+    if isinstance(f1, InducedBy) and isinstance(f2, InducedBy) and f2.induced in f1.inducer_vars():
+        return infer_transitive_induction
         
     elif isinstance(f1, InducedBy) and isinstance(f2, InducedBy) and f1.induced is f2.induced:
-        return infer_induction_union(f1, f2)
+        return infer_induction_union
     elif isinstance(f1, InducedBy) and isinstance(f2, NotIn) and f1.induced is f2.dim_set_var:
-        return infer_not_in_induction(f1, f2)
+        return infer_not_in_induction
     elif isinstance(f1, InducedBy) and isinstance(f2, InUnion):
-        return infer_in_union_induction(f1, f2)
+        return infer_in_union_induction
     elif isinstance(f1, InducedBy) and isinstance(f2, DependsOn):
-        return infer_dependency_induction(f1, f2)
+        return infer_dependency_induction
     return None
 
 def infer_transitive_induction(lhs: InducedBy, rhs: InducedBy):
@@ -326,25 +1480,29 @@ def infer_transitive_induction(lhs: InducedBy, rhs: InducedBy):
     #      Z <== Union(X_1 ? (A_1 u B), ..., X_n ? (A_n u B), Y_1 ? B_1,...,Y_k ? B_k)
     #
     #  If Y_i = X_j then we get X_j ? ((A_j union B) intersect B_i)
+    #
+    #  Dims fresh in Y or Z may be fresh in the conclusion, even where
+    #  the intersection above no longer filters them
 
     old_inducers = { i.dim_set_var:i.filtered_dims for i in lhs.inducers }
     rhs_induced_filtered = old_inducers[rhs.induced]
-    new_inducers = { i.dim_set_var:set(i.filtered_dims).union(rhs_induced_filtered) for i in rhs.inducers }
+    new_inducers = { i.dim_set_var:i.filtered_dims | rhs_induced_filtered for i in rhs.inducers }
 
     redundant_inducers = set(i for i in old_inducers if i in new_inducers)
     for i in redundant_inducers:
-        new_inducers[i] = new_inducers[i].intersection(old_inducers[i])
+        new_inducers[i] = new_inducers[i] & old_inducers[i]
         del old_inducers[i]
     
-    del old_inducers[rhs.induced]
+    # unless Y induces itself, in which case it was handled above
+    old_inducers.pop(rhs.induced, None)
 
     inducers = []
     for i in old_inducers:
-        inducers.append(Inducer(i,tuple(old_inducers[i])))
+        inducers.append(Inducer(i,old_inducers[i]))
     for i in new_inducers:
-        inducers.append(Inducer(i,tuple(new_inducers[i])))
+        inducers.append(Inducer(i,new_inducers[i]))
 
-    return InducedBy(lhs.induced, tuple(inducers))
+    return InducedBy(lhs.induced, tuple(inducers), lhs.fresh_dims | rhs.fresh_dims)
 
 # is this even needed? we should never get two inductions such that one does not reduce to the other
 def infer_induction_union(lhs: InducedBy, rhs: InducedBy):
@@ -355,34 +1513,300 @@ def infer_induction_union(lhs: InducedBy, rhs: InducedBy):
 
 def infer_in_union_induction(lhs: InducedBy, rhs: InUnion):
     inducers = { i.dim_set_var : i.filtered_dims for i in lhs.inducers }
-    if all(d in inducers and rhs.dim not in inducers[d] for d in rhs.dim_set_vars):
+    if all(d in inducers and not has_dim(inducers[d], rhs.dim) for d in rhs.dim_set_vars):
         # Y <== Union(X_1 ? A_1, ..., X_n ? A_n)    a in Union(X_i1,..., X_ik)   a not in Union(A_i1, ..., A_ik)
         # ------------------------------------------------------------------------------------------------------
         #                           a in Y
         return InUnion(rhs.dim, (lhs.induced,))
     elif lhs.induced in rhs.dim_set_vars:
-        # Y <== Union(X_1 ? A_1, ..., X_n ? A_n)    a in Y 
-        # --------------------------------------------------
-        #              a in Union(X_1, ..., X_n)
-
-        return InUnion(rhs.dim, tuple(lhs.inducer_vars()))
+        # Y <== Union(X_1 ? A_1, ..., X_n ? A_n)    a in Union(Y, Z_1, ..., Z_k)    a not fresh in Y
+        # -------------------------------------------------------------------------------------------
+        #                    a in Union(X_1, ..., X_n, Z_1, ..., Z_k)
+        #
+        #  If a is fresh in Y it need not come from any X_i, as in
+        #  Y <== X ? {a} of the +a block, and nothing follows
+
+        if has_dim(lhs.fresh_dims, rhs.dim):
+            return None
+        other_vars = [d for d in rhs.dim_set_vars if d is not lhs.induced]
+        return InUnion(rhs.dim, tuple(lhs.inducer_vars()) + tuple(other_vars))
 
 def infer_not_in_induction(lhs: InducedBy, rhs: NotIn):
     if rhs.dim_set_var is lhs.induced:
         # Y <== Union(X_1 ? A_1,..., A_n) ? A    a not in Y   a not in A_i
         # -----------------------------------------------------------------
         #                           a not in X_i
-        return [NotIn(rhs.dim, inducer.dim_set_var) for inducer in lhs.inducers if rhs.dim not in inducer.filtered_dims]
+        return [NotIn(rhs.dim, inducer.dim_set_var) for inducer in lhs.inducers if not has_dim(inducer.filtered_dims, rhs.dim)]
 
 
 def infer_dependency_induction(lhs: InducedBy, rhs: DependsOn):
-    # Y <== Union(X_1 ? A_1, ..., X_n ? A_n)     a -> Y
-    # -----------------------------------
-    #           a -> X_i ? A_i
+    # Y <== Union(X_1 ? A_1, ..., X_n ? A_n)     a -> Y ? B
+    # ---------------------------------------------------
+    #           a -> X_i ? (A_i u B)
     if rhs.dim_set_var is lhs.induced:
-        return [DependsOn(rhs.dim, i.dim_set_var, i.filtered_dims) for i in lhs.inducers]
+        return [DependsOn(rhs.dim, i.dim_set_var, i.filtered_dims | rhs.filtered_dims) for i in lhs.inducers]
     
 
+# bump whenever inference rules or the encoding of types change
+CACHE_VERSION = 4
+
+def schema_hash(
+        schema: BlockSchema,
+        typing: Typing,
+        goal_directed: bool = False,
+        vectorized: bool = False,
+        memo=None,
+) -> Optional[str]:
+    """
+    Structural hash of a schema. Vertices are numbered in order of first
+    appearance (interface, then block ports, then edges), so it does not
+    depend on vertex identity. Schemas that are already typed, builtins
+    among them, are hashed by their encoded type, which names dims rather
+    than using their ids, so the hash is the same in every process.
+    Other sub-schemas are hashed by their own structure. `memo` keeps the
+    hashes for the duration of one inference.
+    Schemas that reach an untyped recursive schema have no hash and are
+    not cached.
+    """
+    memo = {} if memo is None else memo
+    if schema in memo:
+        # None while the schema is still being hashed further up
+        return memo[schema]
+    memo[schema] = None
+
+    if schema in typing:
+        content = ["typed", typing[schema].encoded()]
+    else:
+        numbers = {}
+
+        def number(v):
+            if v not in numbers:
+                numbers[v] = len(numbers)
+            return numbers[v]
+
+        interface = [[number(v) for v in schema.in_vertices], [number(v) for v in schema.out_vertices]]
+        blocks = [
+            [
+                schema_hash(block.schema, typing, goal_directed, vectorized, memo),
+                [number(block.mapping[v]) for v in block.schema.in_vertices],
+                [number(block.mapping[v]) for v in block.schema.out_vertices],
+            ]
+            for block in schema.blocks
+        ]
+        if any(sub_hash is None for sub_hash, _, _ in blocks):
+            return None
+        edges = sorted(
+            [number(source), number(destination)]
+            for source, destinations in schema.edges.items()
+            for destination in destinations
+        )
+        content = ["schema", interface, blocks, edges]
+
+    digest = hashlib.sha256(json.dumps([CACHE_VERSION, goal_directed, vectorized, content]).encode("utf-8"))
+    memo[schema] = digest.hexdigest()
+    return memo[schema]
+
+def default_cache_directory() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "hocki-klocki", "block-types")
+
+class BlockTyCache:
+    """
+    On-disk cache of encoded block types keyed by schema_hash, shared
+    between runs and processes. Every entry is one JSON file stamped with
+    CACHE_VERSION, written atomically. Reads refresh the modification
+    time, and the least recently used entries are evicted above max_entries
+    (see LruEviction).
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 4096):
+        self.directory = directory or default_cache_directory()
+        self.max_entries = max_entries
+        os.makedirs(self.directory, exist_ok=True)
+        self.eviction = LruEviction(self.directory, max_entries)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            with open(self.path(key)) as f:
+                entry = json.load(f)
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION or "type" not in entry:
+            return None
+        return entry["type"]
+
+    def put(self, key: str, encoded_ty: dict):
+        added = not os.path.exists(self.path(key))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": CACHE_VERSION, "type": encoded_ty}, f)
+        os.replace(tmp_path, self.path(key))
+        if added:
+            self.eviction.added()
+
+def infer_types_parallel(
+        schema: BlockSchema,
+        typing: Typing,
+        max_workers: Optional[int] = None,
+        goal_directed: bool = False,
+        cache: Optional[BlockTyCache] = None,
+        vectorized: bool = False,
+        budget: Optional[Budget] = None,
+        mp_context=None,
+) -> BlockTy:
+    """
+    Infers the types of `schema` and all of its sub-schemas in a process
+    pool. The unit of work is a strongly connected component of schemas,
+    submitted as soon as all the components it uses are typed, so
+    independent definitions are inferred concurrently.
+    Types cross process boundaries in their encoded form.
+
+    The pool starts its workers with `mp_context`, the platform's default
+    start method if None. Workers load this module from its path (see
+    inference_worker.py), so it has to be registered in sys.modules.
+    """
+    if schema in typing:
+        return typing[schema]
+    module = sys.modules.get(__name__)
+    if module is None or vars(module) is not globals():
+        raise RuntimeError(f"{__name__} is not registered in sys.modules, worker processes cannot find it")
+    if budget is not None:
+        budget = budget.started()
+
+    untyped_subs = lambda s: [b.schema for b in s.blocks if b.schema not in typing]
+    components = strongly_connected_components(schema, untyped_subs)
+    component_of = {s: i for i, component in enumerate(components) for s in component}
+    dependents = defaultdict(set)
+    waiting_for = []
+    for i, component in enumerate(components):
+        uses = {component_of[sub] for s in component for sub in untyped_subs(s)} - {i}
+        for j in uses:
+            dependents[j].add(i)
+        waiting_for.append(len(uses))
+
+    with ProcessPoolExecutor(
+            max_workers, mp_context, initializer=init_worker, initargs=(__name__, os.path.abspath(__file__)),
+    ) as pool:
+        running = {}
+
+        def submit(i):
+            members = set(components[i])
+            encoded_sub_types = {
+                b.schema: (typing[b.schema].encoded(), typing[b.schema].incomplete)
+                for s in components[i] for b in s.blocks
+                if b.schema not in members
+            }
+            future = pool.submit(
+                infer_in_worker, components[i], encoded_sub_types, goal_directed, cache, vectorized, budget,
+            )
+            running[future] = i
+
+        for i, count in enumerate(waiting_for):
+            if count == 0:
+                submit(i)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                for s, (encoded, incomplete, growth) in zip(components[i], future.result()):
+                    typing[s] = BlockTy.decoded(encoded, s.in_vertices, s.out_vertices)
+                    typing[s].incomplete = incomplete
+                    typing[s].growth = growth
+                for dependent in dependents[i]:
+                    waiting_for[dependent] -= 1
+                    if waiting_for[dependent] == 0:
+                        submit(dependent)
+    return typing[schema]
+
+class IncrementalTyping:
+    """
+    Keeps the types of a program's schemas between edits. It remembers the
+    sub-schemas each type was derived from, so after an edit only the
+    edited schema and the schemas depending on it are re-typed, and only
+    for as long as their types keep changing.
+    """
+
+    def __init__(self, typing: Typing, goal_directed: bool = False, vectorized: bool = False):
+        self.typing = dict(typing)
+        self.goal_directed = goal_directed
+        self.vectorized = vectorized
+        self.derived_from: Dict[BlockSchema, Set[BlockSchema]] = {}
+        self.dependents: Dict[BlockSchema, Set[BlockSchema]] = defaultdict(set)
+
+    def infer(self, schema: BlockSchema) -> BlockTy:
+        for s in self.post_order(schema, lambda s: (b.schema for b in s.blocks)):
+            if s not in self.typing:
+                self.retype(s)
+        return self.typing[schema]
+
+    def schema_changed(self, schema: BlockSchema) -> Set[BlockSchema]:
+        """
+        Re-types `schema` after it was edited in place, then its transitive
+        dependents whose sub-schema types changed. Returns the re-typed schemas.
+        Recursive schemas are always re-typed together with their component.
+        """
+        old_encoded = {
+            s: self.typing[s].encoded()
+            for s in self.component(schema) if s in self.typing
+        }
+        for s in self.component(schema):
+            self.typing.pop(s, None)
+        self.infer(schema)
+        retyped = set(self.component(schema))
+        changed = {s for s in retyped if self.typing[s].encoded() != old_encoded.get(s)}
+        if not changed:
+            return retyped
+
+        affected = self.post_order(schema, lambda s: self.dependents[s])
+        # reversed post order over dependents is a topological order,
+        # from the edited schema to its outermost users
+        for s in reversed(affected):
+            if s in retyped or not (self.derived_from[s] & changed):
+                continue
+            component = self.component(s)
+            old_encoded = {c: self.typing[c].encoded() for c in component}
+            self.retype(s)
+            retyped.update(component)
+            changed.update(c for c in component if self.typing[c].encoded() != old_encoded[c])
+        return retyped
+
+    def component(self, schema: BlockSchema) -> List[BlockSchema]:
+        # the strongly connected component of `schema` comes out last
+        subs = lambda s: [b.schema for b in s.blocks]
+        return strongly_connected_components(schema, subs)[-1]
+
+    def retype(self, schema: BlockSchema):
+        component = self.component(schema)
+        for s in component:
+            for sub in self.derived_from.get(s, ()):
+                self.dependents[sub].discard(s)
+            self.derived_from[s] = {b.schema for b in s.blocks}
+            for sub in self.derived_from[s]:
+                self.dependents[sub].add(s)
+            self.typing.pop(s, None)
+        infer_types(schema, self.typing, goal_directed=self.goal_directed, vectorized=self.vectorized)
+
+    @staticmethod
+    def post_order(root: BlockSchema, successors) -> List[BlockSchema]:
+        order = []
+        visited = {root}
+        stack = [(root, iter(successors(root)))]
+        while stack:
+            s, children = stack[-1]
+            for child in children:
+                if child not in visited:
+                    visited.add(child)
+                    stack.append((child, iter(successors(child))))
+                    break
+            else:
+                stack.pop()
+                order.append(s)
+        return order
+
 def convert_to_graphviz(schema: BlockSchema):
     subgraphs = ""
     fake_edges = []
@@ -440,7 +1864,7 @@ def chained_dimension_introductions_example():
         add_dim_schema_0: add_dim_ty_0,
         add_dim_schema_1: add_dim_ty_1
     }
-    block_type = infer_types(block_schema, typing)
+    block_type = infer_types(block_schema, typing, observer=PrintingObserver())
 
     print(block_type)
     print(convert_to_graphviz(block_schema))
@@ -482,7 +1906,7 @@ def chained_dimension_removal_example():
         remove_dim_schema_0: remove_dim_ty_0,
         remove_dim_schema_1: remove_dim_ty_1
     }
-    block_type = infer_types(block_schema, typing)
+    block_type = infer_types(block_schema, typing, observer=PrintingObserver())
 
     print(convert_to_graphviz(block_schema))
 
@@ -537,8 +1961,54 @@ def parallel_dimension_removal_example():
     }
 
 
-    infer_types(schema, typing)
+    infer_types(schema, typing, observer=PrintingObserver())
+    print(convert_to_graphviz(schema))
+
+def fresh_dimension_union_example():
+    X1 = Vertex.input()
+    Y1 = Vertex.output()
+
+    sum_ty = union_type(2)
+    add_a_ty = add_fresh_dim_type('a')
+    sum_schema = builtin_schema(2, 1)
+    add_a_schema = builtin_schema(1, 1)
+
+    s0 = sum_schema.instantiate()
+    a0 = add_a_schema.instantiate()
+
+    v0 = s0.mapping[sum_schema.in_vertices[0]]
+    v1 = s0.mapping[sum_schema.in_vertices[1]]
+    v2 = s0.mapping[sum_schema.out_vertices[0]]
+    v3 = a0.mapping[add_a_schema.in_vertices[0]]
+    v4 = a0.mapping[add_a_schema.out_vertices[0]]
+
+    #        X1
+    #       /  \
+    #      |  [+ a]
+    #       \  /
+    #      [sum]
+    #        |
+    #        Y1
+    #
+    # a is in Y1 but not in X1, so Y1 <== X1 must not push it back into X1
+    schema = BlockSchema(
+        [X1], [Y1],
+        [s0, a0],
+        {
+            X1: [v0, v3],
+            v4: [v1],
+            v2: [Y1]
+        }
+    )
+
+    typing = {
+        sum_schema: sum_ty,
+        add_a_schema: add_a_ty
+    }
+
+    infer_types(schema, typing, observer=PrintingObserver())
     print(convert_to_graphviz(schema))
 
 
-parallel_dimension_removal_example()
\ No newline at end of file
+if __name__ == "__main__":
+    parallel_dimension_removal_example()
@@ -0,0 +1,35 @@
+"""
+Entry point of the worker processes of infer_types_parallel.
+
+first-baby-version-algorithm.py is not a valid module name, so a worker
+started by spawn or forkserver cannot import the schemas and functions
+it is sent by reference. This module can be, and every worker loads the
+algorithm from its path first, under the name it has in the parent.
+"""
+import importlib.util
+import sys
+
+algorithm = None
+
+def init_worker(name: str, path: str):
+    # runs before the first task is unpickled
+    global algorithm
+    if name not in sys.modules:
+        # already there when forked, or when the parent is this script run as __main__
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    algorithm = sys.modules[name]
+
+def infer_in_worker(component, encoded_sub_types, goal_directed, cache, vectorized, budget) -> list:
+    # the component and the keys of encoded_sub_types arrive in one pickle,
+    # so they are the same objects on this side too
+    typing = {}
+    for sub, (encoded, incomplete) in encoded_sub_types.items():
+        typing[sub] = algorithm.BlockTy.decoded(encoded, sub.in_vertices, sub.out_vertices)
+        typing[sub].incomplete = incomplete
+    algorithm.infer_types(
+        component[0], typing, goal_directed=goal_directed, cache=cache, vectorized=vectorized, budget=budget,
+    )
+    return [(typing[s].encoded(), typing[s].incomplete, typing[s].growth) for s in component]
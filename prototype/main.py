@@ -1,6 +1,15 @@
+from __future__ import annotations
+
 from dataclasses import dataclass
+from itertools import chain, repeat, tee
+
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Tuple
 
-from typing import List, Dict
+try:
+    import numpy as np
+except ImportError:
+    # the block definitions load without it, only ragged tensors need it
+    np = None
 
 @dataclass
 class Shape:
@@ -42,7 +51,7 @@ class BlockSchema:
 @dataclass
 class Tensor:
     dims: List[int]
-    dependencies: List[(int, int)]
+    dependencies: List[Tuple[int, int]]
 
 @dataclass
 class Block:
@@ -93,6 +102,228 @@ class FreshNameGenerator:
 fresh_name_generator = FreshNameGenerator()
 split_chars_block = Block(split_chars_schema, [], {"d": fresh_name_generator.fresh()})
 
+
+@dataclass
+class RaggedTensor:
+    """
+    Values indexed by dims, stored CSR style: every dim is a level of
+    nesting with its own offsets array, so a dim may depend on all dims
+    before it (y -> x when y comes after x). offsets[i] has one entry
+    more than there are elements of the previous levels, offsets[0]
+    is [0, n]. The innermost level indexes `values` directly.
+    Independent dims are levels whose segments all have the same length.
+    """
+    dims: List[int]
+    offsets: List[np.ndarray]
+    values: np.ndarray
+
+    @staticmethod
+    def from_nested(dims: List[int], nested) -> 'RaggedTensor':
+        # from nested Python lists, one level per dim
+        if np is None:
+            raise ImportError("ragged tensors need numpy")
+        offsets = []
+        level = [nested]
+        for _ in dims:
+            lengths = [len(xs) for xs in level]
+            offsets.append(np.concatenate([[0], np.cumsum(lengths)]).astype(np.intp))
+            level = [x for xs in level for x in xs]
+        return RaggedTensor(dims, offsets, np.array(level))
+
+    def to_nested(self):
+        nested = self.values.tolist()
+        for level_offsets in reversed(self.offsets):
+            nested = [nested[start:end] for start, end in zip(level_offsets[:-1], level_offsets[1:])]
+        return nested[0]
+
+    @staticmethod
+    def concatenate(chunks: List['RaggedTensor']) -> 'RaggedTensor':
+        # inverse of chunks, joins tensors over the same dims along the outermost one
+        first = chunks[0]
+        if not first.dims:
+            return first
+        offsets = [np.array([0, sum(int(c.offsets[0][-1]) for c in chunks)], dtype=np.intp)]
+        for level in range(1, len(first.dims)):
+            bases = np.cumsum([0] + [c.offsets[level][-1] for c in chunks[:-1]])
+            offsets.append(np.concatenate([[0]] + [c.offsets[level][1:] + base for c, base in zip(chunks, bases)]))
+        return RaggedTensor(first.dims, offsets, np.concatenate([c.values for c in chunks]))
+
+    def chunks(self, size: int) -> Iterator['RaggedTensor']:
+        """
+        Splits the tensor into slices of `size` elements of the outermost dim.
+        Inner segments never cross a chunk boundary, so every kernel but
+        the ones along the outermost dim can run chunk by chunk.
+        """
+        if not self.dims:
+            yield self
+            return
+        for start in range(0, max(int(self.offsets[0][-1]), 1), size):
+            yield self.outer_slice(start, min(start + size, int(self.offsets[0][-1])))
+
+    def outer_slice(self, start: int, stop: int) -> 'RaggedTensor':
+        # elements start to stop of the outermost dim, sharing memory with this tensor
+        offsets = [np.array([0, stop - start], dtype=np.intp)]
+        for level in range(1, len(self.dims)):
+            level_offsets = self.offsets[level][start:stop + 1]
+            offsets.append(level_offsets - level_offsets[0])
+            start, stop = int(level_offsets[0]), int(level_offsets[-1])
+        return RaggedTensor(self.dims, offsets, self.values[start:stop])
+
+    def lengths(self, level: int) -> np.ndarray:
+        return np.diff(self.offsets[level])
+
+    def segment_ids(self) -> np.ndarray:
+        # for every value, the index of the innermost segment containing it
+        return np.repeat(np.arange(len(self.offsets[-1]) - 1), self.lengths(-1))
+
+    def broadcast_to(self, other: 'RaggedTensor') -> np.ndarray:
+        """
+        Values repeated over the dims `other` has after the ones of this
+        tensor, which have to be the outer dims of `other` with the same layout.
+        """
+        depth = len(self.dims)
+        if other.dims[:depth] != self.dims:
+            raise ValueError(f"dims {self.dims} are not the outer dims of {other.dims}")
+        if not all(np.array_equal(a, b) for a, b in zip(self.offsets, other.offsets)):
+            raise ValueError(f"tensors over {self.dims} have different layouts")
+        index = np.arange(len(self.values))
+        for level in range(depth, len(other.dims)):
+            index = np.repeat(index, other.lengths(level))
+        return self.values[index]
+
+def split_chars(strings: RaggedTensor, fresh_dim: int) -> RaggedTensor:
+    # introduces `fresh_dim`, depending on all dims of `strings`, indexing characters
+    values = np.asarray(strings.values, dtype=str)
+    lengths = np.char.str_len(values)
+    width = values.dtype.itemsize // np.dtype("U1").itemsize
+    # every string is a row of `width` characters padded with empty ones
+    padded = np.ascontiguousarray(values).view("U1").reshape(len(values), width)
+    chars = padded[np.arange(width) < lengths[:, None]]
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.intp)
+    return RaggedTensor(strings.dims + [fresh_dim], strings.offsets + [offsets], chars)
+
+def sort_along(tensor: RaggedTensor, dim: int) -> RaggedTensor:
+    check_innermost(tensor, dim)
+    # stable sort by segment first, so every segment stays in place
+    order = np.lexsort((tensor.values, tensor.segment_ids()))
+    return RaggedTensor(tensor.dims, tensor.offsets, tensor.values[order])
+
+def fold_along(tensor: RaggedTensor, dim: int, ufunc: np.ufunc) -> RaggedTensor:
+    """
+    fold by `dim` with a NumPy ufunc, e.g. sum by y is np.add. Every segment
+    is reduced at once by reduceat, empty ones get the identity of the ufunc.
+    """
+    check_innermost(tensor, dim)
+    lengths = tensor.lengths(-1)
+    non_empty = lengths > 0
+    if ufunc.identity is None and not non_empty.all():
+        raise ValueError(f"{ufunc.__name__} by {dim} over an empty segment")
+    result = np.full(len(lengths), ufunc.identity if ufunc.identity is not None else 0, dtype=tensor.values.dtype)
+    if non_empty.any():
+        # empty segments have the start of the next one, so skipping them does not change the others
+        result[non_empty] = ufunc.reduceat(tensor.values, tensor.offsets[-1][:-1][non_empty])
+    return RaggedTensor(tensor.dims[:-1], tensor.offsets[:-1], result)
+
+def check_innermost(tensor: RaggedTensor, dim: int):
+    if not tensor.dims or tensor.dims[-1] != dim:
+        # outer dims may have dims depending on them, see sum by x in docs/main.txt
+        raise ValueError(f"dim {dim} is not the innermost dim of {tensor.dims}")
+
+def pointwise(ufunc: np.ufunc, lhs: RaggedTensor, rhs: RaggedTensor) -> RaggedTensor:
+    # over the dims of the deeper tensor, the other one repeated over the dims it lacks
+    if len(lhs.dims) < len(rhs.dims):
+        return RaggedTensor(rhs.dims, rhs.offsets, ufunc(lhs.broadcast_to(rhs), rhs.values))
+    return RaggedTensor(lhs.dims, lhs.offsets, ufunc(lhs.values, rhs.broadcast_to(lhs)))
+
+Kernel = Callable[[List[RaggedTensor], Dict[str, int]], List[RaggedTensor]]
+
+def kernel_for(schema: BlockSchema) -> Kernel:
+    # arguments and results follow shape.inputs and shape.outputs,
+    # dims are the block's map from local dim names to global ones
+    if np is None:
+        raise ImportError("evaluating blocks needs numpy")
+    if schema is add_schema:
+        return lambda args, dims: [pointwise(np.add, *args)]
+    elif schema is sum_along_schema:
+        return lambda args, dims: [fold_along(args[0], dims["d"], np.add)]
+    elif schema is sort_schema:
+        return lambda args, dims: [sort_along(args[0], dims["d"])]
+    elif schema is split_chars_schema:
+        return lambda args, dims: [split_chars(args[0], dims["d"])]
+    raise ValueError(f"No kernel for a block with shape {schema.shape}")
+
+def evaluate(block: Block, inputs: Dict[str, RaggedTensor], memo: Optional[Dict[int, List[RaggedTensor]]] = None) -> List[RaggedTensor]:
+    """
+    Outputs of `block`. The outputs of its arguments fill its inputs in
+    order, the remaining ones are taken from `inputs` by name. A block
+    used as the argument of several others is evaluated once.
+    """
+    memo = {} if memo is None else memo
+    if id(block) not in memo:
+        args = [output for argument in block.arguments for output in evaluate(argument, inputs, memo)]
+        args += [inputs[name] for name in block.schema.shape.inputs[len(args):]]
+        memo[id(block)] = kernel_for(block.schema)(args, block.dimensions)
+    return memo[id(block)]
+
+
+def stream(block: Block, inputs: Dict[str, Iterable[RaggedTensor]], memo: Optional[Dict] = None) -> Iterator[RaggedTensor]:
+    """
+    Chunks of the output of `block`, computed lazily from chunks of
+    `inputs` split along their outermost dim (see RaggedTensor.chunks).
+    Every block holds a chunk at a time, so a pipeline never materializes
+    an intermediate tensor. Arguments used by several blocks and inputs
+    read by several blocks are teed.
+    """
+    memo = {} if memo is None else memo
+    if len(block.schema.shape.outputs) != 1:
+        raise ValueError(f"Only blocks with one output stream, not {block.schema.shape}")
+    args = [shared(memo, id(argument), lambda a=argument: stream(a, inputs, memo)) for argument in block.arguments]
+    args += [
+        shared(memo, name, lambda name=name: iter(inputs[name]))
+        for name in block.schema.shape.inputs[len(args):]
+    ]
+    return streamed(block, args)
+
+def shared(memo: Dict, key, make: Callable[[], Iterator]) -> Iterator:
+    # a new copy of the stream under `key` for every consumer
+    if key not in memo:
+        memo[key] = make()
+    memo[key], copy = tee(memo[key])
+    return copy
+
+def streamed(block: Block, args: List[Iterator[RaggedTensor]]) -> Iterator[RaggedTensor]:
+    kernel = kernel_for(block.schema)
+    chunks = zip(*broadcast(args))
+    for chunk_args in chunks:
+        dim = block.dimensions.get("d")
+        if (block.schema is sum_along_schema or block.schema is sort_schema) and chunk_args[0].dims[:1] == [dim]:
+            # the chunks split the dim the block needs whole
+            yield from along_outermost(block, chain([chunk_args], chunks))
+            return
+        yield kernel(list(chunk_args), block.dimensions)[0]
+
+def broadcast(args: List[Iterator[RaggedTensor]]) -> List[Iterator[RaggedTensor]]:
+    # a tensor without dims is a single chunk, it goes along every chunk of the others
+    firsts = [next(arg, None) for arg in args]
+    if any(first is None for first in firsts):
+        return []
+    if all(not first.dims for first in firsts):
+        return [iter([first]) for first in firsts]
+    return [chain([first], arg) if first.dims else repeat(first) for first, arg in zip(firsts, args)]
+
+def along_outermost(block: Block, chunks: Iterator[Tuple[RaggedTensor, ...]]) -> Iterator[RaggedTensor]:
+    # a fold only keeps its running result, a sort has to buffer the whole dim
+    dim = block.dimensions["d"]
+    if block.schema is sum_along_schema:
+        total = None
+        for chunk, in chunks:
+            partial = fold_along(chunk, dim, np.add)
+            total = partial if total is None else RaggedTensor([], [], np.add(total.values, partial.values))
+        yield total
+    else:
+        whole = RaggedTensor.concatenate([chunk for chunk, in chunks])
+        yield sort_along(whole, dim)
+
 # :pepela:
 # tego nie przemyślałem a to chyba istotne jest
 # D u {x} -> [split_chars]                   ----> E
@@ -104,4 +335,4 @@ split_chars_block = Block(split_chars_schema, [], {"d": fresh_name_generator.fre
 # ale może warto to reprezentować
 # ej :kekwait: ale to można dać funkcji różne wymiary na inputach?
 # ja myślałem że jak wymiary inputów się różnią to tylko jak explicite powiemy, a reszta ma się zgadzać :thunk:
-# :thunk: no to o to trzeba dopytać, ja myślałem że tam mogą być jakiekolwiek wymiary i my tylko podajemy których wymagamy
\ No newline at end of file
+# :thunk: no to o to trzeba dopytać, ja myślałem że tam mogą być jakiekolwiek wymiary i my tylko podajemy których wymagamy
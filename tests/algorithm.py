@@ -0,0 +1,22 @@
+"""
+The inference prototype. Its file name is not a valid module name, so it
+is loaded from its path and registered in sys.modules under the name the
+benchmarks use, as worker processes and pickles refer to it by name.
+"""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NAME = "first_baby_version_algorithm"
+
+def load():
+    if NAME not in sys.modules:
+        path = os.path.join(ROOT, "prototype", "first-baby-version-algorithm.py")
+        spec = importlib.util.spec_from_file_location(NAME, path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[NAME] = module
+        spec.loader.exec_module(module)
+    return sys.modules[NAME]
+
+proto = load()
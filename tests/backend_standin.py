@@ -0,0 +1,39 @@
+"""
+Stands in for `app.jar --serve` (see pipeline/serve.scala), speaking the
+same framed protocol without a JVM. A compile writes an empty program to
+its output, unless the source asks otherwise:
+    fail     answers ok: false, writing nothing
+    hang     never answers
+    crash    exits with code 3
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webapp"))
+
+from backend import read_frame, write_frame
+
+def answer(request):
+    if request["kind"] == "ping":
+        return {"id": request["id"], "ok": True}
+    if request["kind"] != "compile":
+        return {"id": request["id"], "ok": False, "log": f"Unknown request kind: {request['kind']}"}
+    with open(request["source"]) as f:
+        source = f.read()
+    if source == "hang":
+        time.sleep(3600)
+    if source == "crash":
+        os._exit(3)
+    if source == "fail":
+        return {"id": request["id"], "ok": False, "log": "TRAGEDY: cannot parse fail"}
+    with open(request["output"], "w") as f:
+        f.write("{}")
+    if request.get("typing"):
+        with open(request["typing"], "w") as f:
+            f.write(f"typing of {source}")
+    return {"id": request["id"], "ok": True, "log": f"compiled in {os.getpid()}"}
+
+if __name__ == "__main__":
+    while (request := read_frame(sys.stdin.buffer)) is not None:
+        write_frame(sys.stdout.buffer, answer(request))
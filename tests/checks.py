@@ -0,0 +1,87 @@
+"""
+Checks of inferred types that do not depend on how they were derived:
+comparing constraint sets by what they entail, and evaluating programs
+of builtin blocks by brute force.
+"""
+import numpy as np
+
+from algorithm import proto
+
+def constraints(block_ty) -> set:
+    return block_ty.direct_constraints | block_ty.indirect_constraints
+
+def covered(fact, facts) -> bool:
+    # whether fact is in facts or implied by one of them alone
+    if fact in facts:
+        return True
+    if isinstance(fact, proto.InUnion):
+        # a in Union(X) implies a in Union(X, Y)
+        return any(
+            isinstance(g, proto.InUnion) and g.dim == fact.dim and set(g.dim_set_vars) <= set(fact.dim_set_vars)
+            for g in facts
+        )
+    if isinstance(fact, proto.InducedBy):
+        return any(isinstance(g, proto.InducedBy) and g.subsumes(fact) for g in facts)
+    if isinstance(fact, proto.DependsOn):
+        return any(
+            isinstance(g, proto.DependsOn) and g.dim == fact.dim and g.dim_set_var is fact.dim_set_var
+            and proto.is_subset(g.filtered_dims, fact.filtered_dims)
+            for g in facts
+        )
+    return False
+
+def equivalent(lhs, rhs) -> bool:
+    """
+    Whether two types of the same schema state the same, up to facts
+    implied by stronger ones
+    """
+    lhs, rhs = constraints(lhs), constraints(rhs)
+    return all(covered(f, rhs) for f in lhs) and all(covered(f, lhs) for f in rhs)
+
+def block_kind(block_ty) -> str:
+    # "union", "remove" or "add", for the types of the builtin blocks
+    if len(block_ty.in_dim_vars) > 1:
+        return "union"
+    in_union, = (c for c in block_ty.direct_constraints if isinstance(c, proto.InUnion))
+    if in_union.dim_set_vars == (block_ty.in_dim_vars[0],):
+        return "remove"
+    return "add"
+
+def satisfiable(schema, typing) -> bool:
+    """
+    Whether some dims of the inputs of `schema`, a schema of builtin
+    union, remove and add blocks, let every block run. Evaluates all
+    assignments at once, dims being bits of integers.
+    """
+    dims = sorted({
+        proto.dim_table.name(c.dim)
+        for b in schema.blocks if len(b.schema.in_vertices) == 1
+        for c in typing[b.schema].direct_constraints
+    })
+    bit = {d: 1 << i for i, d in enumerate(dims)}
+    width = len(dims)
+    assignments = np.arange(1 << (width * len(schema.in_vertices)), dtype=np.int64)
+    value = {x: (assignments >> (width * j)) & ((1 << width) - 1) for j, x in enumerate(schema.in_vertices)}
+    source = {d: v for v, destinations in schema.edges.items() for d in destinations}
+    runs = np.ones(len(assignments), dtype=bool)
+    # blocks in order of their inputs being known
+    blocks = list(schema.blocks)
+    while blocks:
+        block = next(b for b in blocks if all(source[b.mapping[v]] in value for v in b.schema.in_vertices))
+        blocks.remove(block)
+        ins = [value[source[block.mapping[v]]] for v in block.schema.in_vertices]
+        ty = typing[block.schema]
+        kind = block_kind(ty)
+        if kind == "union":
+            out = np.bitwise_or.reduce(ins)
+        else:
+            dim, = (bit[proto.dim_table.name(c.dim)] for c in ty.direct_constraints if isinstance(c, proto.InUnion))
+            x, = ins
+            if kind == "remove":
+                runs &= (x & dim) != 0
+                out = x & ~dim
+            else:
+                runs &= (x & dim) == 0
+                out = x | dim
+        value[block.mapping[block.schema.out_vertices[0]]] = out
+    return bool(runs.any())
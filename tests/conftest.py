@@ -0,0 +1,22 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "prototype"))
+sys.path.insert(0, os.path.join(ROOT, "webapp"))
+
+import pytest
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    # the web app, working in tmp_path, with a fresh render cache and no backend yet
+    pytest.importorskip("flask")
+    pytest.importorskip("requests")
+    monkeypatch.chdir(tmp_path)
+    import server
+    from render_cache import RenderCache
+    monkeypatch.setattr(server, "render_cache", RenderCache(str(tmp_path / "render-cache")))
+    yield server
+    if server.backend_pool is not None:
+        server.backend_pool.close()
+        server.backend_pool = None
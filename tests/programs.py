@@ -0,0 +1,94 @@
+"""
+Programs to type: the examples of the prototype, and seeded random chains
+of the builtin blocks.
+"""
+import random
+from unittest import mock
+
+from algorithm import proto
+
+def random_program(size: int, seed: int, dims: str = "abcd"):
+    """
+    A schema of `size` blocks over two inputs and one output, with its
+    typing. Every block is a union of any two earlier vertices, or removes
+    one of `dims`, or adds a fresh one, after one of the last three.
+    """
+    rnd = random.Random(seed)
+    typing = {}
+    unary = []
+    for d in dims:
+        for ty in (proto.remove_dim_type(d), proto.add_fresh_dim_type(d + "f")):
+            schema = proto.builtin_schema(1, 1)
+            typing[schema] = ty
+            unary.append(schema)
+    union = proto.builtin_schema(2, 1)
+    typing[union] = proto.union_type(2)
+
+    inputs = [proto.Vertex.input() for _ in range(2)]
+    output = proto.Vertex.output()
+    available = list(inputs)
+    edges = {}
+    blocks = []
+    for _ in range(size):
+        if rnd.random() < 0.3:
+            block = union.instantiate()
+            for v in union.in_vertices:
+                edges.setdefault(rnd.choice(available), []).append(block.mapping[v])
+        else:
+            block = rnd.choice(unary).instantiate()
+            edges.setdefault(rnd.choice(available[-3:]), []).append(block.mapping[block.schema.in_vertices[0]])
+        available.append(block.mapping[block.schema.out_vertices[0]])
+        blocks.append(block)
+    edges.setdefault(available[-1], []).append(output)
+    return proto.BlockSchema(inputs, [output], blocks, edges), typing
+
+# seeds of random_program(6 + seed % 20, seed), without 95, which takes a minute to saturate
+SEEDS = [seed for seed in range(120) if seed != 95]
+
+def seeded_program(seed: int):
+    return random_program(6 + seed % 20, seed)
+
+EXAMPLES = [
+    "chained_dimension_introductions_example",
+    "chained_dimension_removal_example",
+    "parallel_dimension_removal_example",
+    "fresh_dimension_union_example",
+]
+
+class Typed(Exception):
+    pass
+
+def example_program(name: str):
+    """
+    The schema and typing the example function `name` of the prototype
+    types, stopping it there rather than letting it print the result
+    """
+    captured = []
+
+    def infer_types(schema, typing, **options):
+        captured.append((schema, dict(typing)))
+        raise Typed()
+
+    with mock.patch.object(proto, "infer_types", infer_types):
+        try:
+            getattr(proto, name)()
+        except Typed:
+            pass
+    program, = captured
+    return program
+
+def program(example_or_seed):
+    # an example by name, a seed, or the arguments of random_program
+    if isinstance(example_or_seed, str):
+        return example_program(example_or_seed)
+    if isinstance(example_or_seed, tuple):
+        return random_program(*example_or_seed)
+    return seeded_program(example_or_seed)
+
+# options of infer_types for each way of saturating
+MODES = {
+    "naive": dict(semi_naive=False),
+    "semi-naive": dict(),
+    "goal-directed": dict(goal_directed=True),
+    "vectorized": dict(vectorized=True),
+}
@@ -0,0 +1,74 @@
+import os
+import shlex
+import sys
+import threading
+
+import pytest
+
+from backend import BackendCancelled, BackendError, BackendPool, BackendTimeout
+
+STANDIN = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend_standin.py")]
+
+@pytest.fixture
+def pool():
+    pool = BackendPool(size=1, command=STANDIN, timeout=5.0, health_interval=0)
+    yield pool
+    pool.close()
+
+def compile_source(pool, tmp_path, source, **kwargs):
+    (tmp_path / "file.dfl").write_text(source)
+    output = tmp_path / "file.json"
+    answer = pool.compile(str(tmp_path / "file.dfl"), str(output), 2, **kwargs)
+    return answer, output
+
+def test_compiles_answer_their_own_request(pool, tmp_path):
+    answer, output = compile_source(pool, tmp_path, "x")
+    assert answer["ok"] and output.read_text() == "{}"
+    (tmp_path / "typing.txt").unlink(missing_ok=True)
+    answer, _ = compile_source(pool, tmp_path, "y", typing=str(tmp_path / "typing.txt"))
+    assert answer["ok"] and (tmp_path / "typing.txt").read_text() == "typing of y"
+    assert pool.request({"kind": "ping"})["ok"]
+
+def test_one_warm_process_answers_every_request(pool, tmp_path):
+    logs = {compile_source(pool, tmp_path, "x")[0]["log"] for _ in range(20)}
+    assert len(logs) == 1
+    assert pool.status()[0]["restarts"] == 0
+
+def test_failed_compile_keeps_the_worker(pool, tmp_path):
+    answer, output = compile_source(pool, tmp_path, "fail")
+    assert not answer["ok"] and "TRAGEDY" in answer["log"] and not output.exists()
+    assert pool.status()[0]["restarts"] == 0
+
+def test_crashed_worker_is_restarted(pool, tmp_path):
+    with pytest.raises(BackendError, match="exited with code 3"):
+        compile_source(pool, tmp_path, "crash")
+    assert pool.status()[0]["restarts"] == 1
+    assert compile_source(pool, tmp_path, "x")[0]["ok"]
+
+def test_hanging_worker_times_out_and_is_restarted(pool, tmp_path):
+    with pytest.raises(BackendTimeout):
+        compile_source(pool, tmp_path, "hang", timeout=0.5)
+    assert pool.status()[0]["restarts"] == 1
+    assert compile_source(pool, tmp_path, "x")[0]["ok"]
+
+def test_cancelled_request_stops_waiting(pool, tmp_path):
+    cancelled = threading.Event()
+    threading.Timer(0.2, cancelled.set).start()
+    with pytest.raises(BackendCancelled):
+        compile_source(pool, tmp_path, "hang", cancelled=cancelled)
+    assert compile_source(pool, tmp_path, "x")[0]["ok"]
+
+def test_health_check_restarts_dead_workers(pool):
+    worker = pool.workers[0]
+    worker.process.kill()
+    worker.process.wait()
+    pool.check_health()
+    assert worker.alive() and worker.restarts == 1
+
+def test_server_starts_the_configured_backend_on_first_use(server, monkeypatch):
+    monkeypatch.setenv("DFL_BACKEND_WORKERS", "1")
+    monkeypatch.setenv("DFL_BACKEND_COMMAND", shlex.join(STANDIN))
+    assert server.backend_pool is None
+    status = server.app.test_client().get("/backend-status").get_json()
+    assert len(status) == 1 and status[0]["alive"]
+    assert server.backend().request({"kind": "ping"})["ok"]
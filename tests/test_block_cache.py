@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+from algorithm import proto
+from programs import random_program
+
+@pytest.mark.parametrize("content", [
+    "not json",
+    json.dumps(["a", "list"]),
+    json.dumps({"version": proto.CACHE_VERSION}),
+    json.dumps({"version": proto.CACHE_VERSION - 1, "type": {}}),
+])
+def test_corrupt_or_stale_entries_are_misses(tmp_path, content):
+    cache = proto.BlockTyCache(str(tmp_path))
+    with open(cache.path("key"), "w") as f:
+        f.write(content)
+    assert cache.get("key") is None
+
+def test_cached_types_are_served_to_later_runs(tmp_path):
+    schema, typing = random_program(10, 1)
+    cache = proto.BlockTyCache(str(tmp_path))
+    expected = proto.infer_types(schema, dict(typing), cache=cache).encoded()
+    key = proto.schema_hash(schema, typing)
+    assert cache.get(key) == expected
+
+    # a later run, with a new cache over the same directory
+    typing = dict(typing)
+    assert proto.infer_types(schema, typing, cache=proto.BlockTyCache(str(tmp_path))).encoded() == expected
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = proto.BlockTyCache(str(tmp_path), max_entries=10)
+    for i in range(10):
+        cache.put(f"{i}", {"i": i})
+        os.utime(cache.path(f"{i}"), (i, i))
+    # reading refreshes an entry
+    assert cache.get("0") == {"i": 0}
+    cache.put("10", {"i": 10})
+    left = sorted(name for name in os.listdir(tmp_path) if name.endswith(".json"))
+    assert len(left) == 9
+    assert "0.json" in left and "10.json" in left and "1.json" not in left and "2.json" not in left
+
+def test_writes_do_not_list_the_directory_every_time(tmp_path, monkeypatch):
+    cache = proto.BlockTyCache(str(tmp_path), max_entries=100)
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listings.append(path) or listdir(path))
+    for i in range(1000):
+        cache.put(f"{i}", {"i": i})
+    assert len(os.listdir(tmp_path)) <= 100
+    # one listing every tenth of max_entries writes, once the cache is full
+    assert len(listings) <= 100
@@ -0,0 +1,240 @@
+import pytest
+
+from algorithm import proto
+from checks import equivalent, satisfiable
+from programs import EXAMPLES, MODES, SEEDS, program
+
+def typed(example_or_seed, mode: str):
+    # the type in the given mode, or Contradiction if it raised one
+    schema, typing = program(example_or_seed)
+    try:
+        return proto.infer_types(schema, typing, **MODES[mode])
+    except proto.Contradiction:
+        return proto.Contradiction
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS)
+def test_semi_naive_types_match_naive_ones(example_or_seed):
+    naive = typed(example_or_seed, "naive")
+    semi_naive = typed(example_or_seed, "semi-naive")
+    if naive is proto.Contradiction or semi_naive is proto.Contradiction:
+        assert naive is semi_naive
+    else:
+        assert semi_naive.encoded() == naive.encoded()
+
+class BlockFacts(proto.InferenceObserver):
+    # the facts of the blocks of the last schema, before saturation
+    def facts(self, stage, facts):
+        if stage == "before":
+            self.before = facts
+
+def saturated(example_or_seed):
+    # a FactStore of the facts derived for the program, up to the first contradiction
+    schema, typing = program(example_or_seed)
+    observer = BlockFacts()
+    try:
+        proto.infer_types(schema, typing, observer=observer)
+    except proto.Contradiction:
+        pass
+    store = proto.FactStore()
+    try:
+        proto.saturate_into(store, observer.before)
+    except proto.Contradiction:
+        pass
+    return schema, store
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS)
+def test_candidate_pairs_include_every_pair_a_rule_fires_on(example_or_seed):
+    _, store = saturated(example_or_seed)
+    for fact in store:
+        candidates = set(store.candidate_pairs(fact))
+        for other in store:
+            for pair in (fact, other), (other, fact):
+                if proto.conclusions_of(*pair):
+                    assert pair in candidates
+
+def wrapped(schema, typing):
+    # the same program, with every block inside a schema of its own that only links to it
+    typing = dict(typing)
+    wrappers = {}
+    blocks = []
+    for block in schema.blocks:
+        inner = block.schema
+        if inner not in wrappers:
+            instance = inner.instantiate()
+            in_vertices = [proto.Vertex.input() for _ in inner.in_vertices]
+            out_vertices = [proto.Vertex.output() for _ in inner.out_vertices]
+            edges = {x: [instance.mapping[v]] for x, v in zip(in_vertices, inner.in_vertices)}
+            edges |= {instance.mapping[v]: [y] for y, v in zip(out_vertices, inner.out_vertices)}
+            wrappers[inner] = proto.BlockSchema(in_vertices, out_vertices, [instance], edges)
+        wrapper = wrappers[inner]
+        mapping = {w: block.mapping[v] for w, v in zip(wrapper.in_vertices, inner.in_vertices)}
+        mapping |= {w: block.mapping[v] for w, v in zip(wrapper.out_vertices, inner.out_vertices)}
+        blocks.append(proto.Block(wrapper, mapping))
+    return proto.BlockSchema(schema.in_vertices, schema.out_vertices, blocks, schema.edges), typing
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS)
+def test_links_into_wrapping_schemas_change_nothing(example_or_seed):
+    expected = typed(example_or_seed, "semi-naive")
+    schema, typing = wrapped(*program(example_or_seed))
+    try:
+        ty = proto.infer_types(schema, typing)
+    except proto.Contradiction:
+        assert expected is proto.Contradiction
+    else:
+        assert expected is not proto.Contradiction
+        assert ty.encoded() == expected.encoded()
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS)
+def test_facts_are_about_one_vertex_of_every_linked_class(example_or_seed):
+    schema, store = saturated(example_or_seed)
+    variables = set().union(*(proto.constraint_vars(f) for f in store))
+    for source, destinations in schema.edges.items():
+        assert len(variables & {source, *destinations}) <= 1
+
+def test_facts_about_a_linked_class_hold_for_each_of_its_interface_vertices():
+    # Y0 is linked to X, Y1 is X without a
+    remove_a = proto.builtin_schema(1, 1)
+    block = remove_a.instantiate()
+    x = proto.Vertex.input()
+    y0, y1 = proto.Vertex.output(), proto.Vertex.output()
+    schema = proto.BlockSchema([x], [y0, y1], [block], {
+        x: [block.mapping[remove_a.in_vertices[0]], y0],
+        block.mapping[remove_a.out_vertices[0]]: [y1],
+    })
+    ty = proto.infer_types(schema, {remove_a: proto.remove_dim_type("a")})
+    a = proto.dim_table.intern("a")
+    assert {proto.InUnion(a, (x,)), proto.InUnion(a, (y0,)), proto.NotIn(a, y1)} <= ty.direct_constraints
+    assert {
+        proto.InducedBy(y1, (proto.Inducer(x, 1 << a),)), proto.InducedBy(y1, (proto.Inducer(y0, 1 << a),)),
+    } <= ty.indirect_constraints
+
+def chain(*blocks):
+    # X followed by the blocks, "-a" removing and "+a" adding the dim a
+    typing = {}
+    x, y = proto.Vertex.input(), proto.Vertex.output()
+    edges = {}
+    instances = []
+    last = x
+    for b in blocks:
+        schema = proto.builtin_schema(1, 1)
+        typing[schema] = proto.remove_dim_type(b[1:]) if b[0] == "-" else proto.add_fresh_dim_type(b[1:])
+        instance = schema.instantiate()
+        edges.setdefault(last, []).append(instance.mapping[schema.in_vertices[0]])
+        last = instance.mapping[schema.out_vertices[0]]
+        instances.append(instance)
+    edges.setdefault(last, []).append(y)
+    return proto.BlockSchema([x], [y], instances, edges), typing
+
+@pytest.mark.parametrize("blocks", [
+    ("-b", "+c", "-b"), ("+a", "-c", "+a"), ("-a", "-b", "-a"), ("-a", "+a"), ("-a", "-b", "+a", "-a"),
+])
+@pytest.mark.parametrize("mode", MODES)
+def test_chains_contradict_if_a_dim_is_removed_or_added_twice(blocks, mode):
+    schema, typing = chain(*blocks)
+    if satisfiable(schema, typing):
+        proto.infer_types(schema, typing, **MODES[mode])
+    else:
+        with pytest.raises(proto.Contradiction):
+            proto.infer_types(schema, typing, **MODES[mode])
+
+def assert_same_types(example_or_seed, mode: str):
+    # compared by what they entail, on the same vertices
+    schema, typing = program(example_or_seed)
+    try:
+        expected = proto.infer_types(schema, dict(typing))
+    except proto.Contradiction:
+        with pytest.raises(proto.Contradiction):
+            proto.infer_types(schema, dict(typing), **MODES[mode])
+    else:
+        assert equivalent(proto.infer_types(schema, dict(typing), **MODES[mode]), expected)
+
+# larger than the seeded programs, so that more internal vertices are eliminated
+GOAL_DIRECTED_CASES = [pytest.param((20, 7100, "abcdefgh"), id="7100-abcdefgh")]
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS + GOAL_DIRECTED_CASES)
+def test_goal_directed_types_match_semi_naive_ones(example_or_seed):
+    assert_same_types(example_or_seed, "goal-directed")
+
+# seeded programs on which the closure once lost facts the rules derive, as did 107
+VECTORIZED_CASES = [251, 354]
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS + VECTORIZED_CASES)
+def test_vectorized_types_match_semi_naive_ones(example_or_seed):
+    assert_same_types(example_or_seed, "vectorized")
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS)
+def test_every_mode_raises_the_same_contradictions(example_or_seed):
+    schema, typing = program(example_or_seed)
+    raised = set()
+    for options in MODES.values():
+        try:
+            proto.infer_types(schema, dict(typing), **options)
+            raised.add(False)
+        except proto.Contradiction:
+            raised.add(True)
+    assert len(raised) == 1
+
+@pytest.mark.parametrize("mode", MODES)
+def test_contradictions_carry_the_conflict_and_its_derivation(mode):
+    contradictions = 0
+    for seed in SEEDS:
+        schema, typing = program(seed)
+        observer = BlockFacts()
+        try:
+            proto.infer_types(schema, typing, observer=observer, **MODES[mode])
+            continue
+        except proto.Contradiction as e:
+            contradiction = e
+        contradictions += 1
+        # a in Union(X_1, ..., X_n) and a not in X_i for every i
+        in_union, *not_ins = contradiction.facts
+        assert isinstance(in_union, proto.InUnion)
+        assert all(isinstance(f, proto.NotIn) and f.dim == in_union.dim for f in not_ins)
+        assert [f.dim_set_var for f in not_ins] == list(in_union.dim_set_vars)
+
+        known = set(observer.before)
+        for conclusion, rule, (f1, f2) in contradiction.firings:
+            assert rule == proto.rule_for(f1, f2).__name__
+            assert conclusion in proto.conclusions_of(f1, f2)
+            if mode in ("naive", "semi-naive"):
+                # premises come from the blocks or from earlier firings
+                assert f1 in known and f2 in known
+                known.add(conclusion)
+    assert contradictions > 0
+
+@pytest.mark.parametrize("mode", MODES)
+def test_budgets_stop_after_the_round_exceeding_them(mode):
+    rounds = 0
+    # every program is typed six times, the first seeds are enough
+    for example_or_seed in EXAMPLES + SEEDS[:80]:
+        schema, typing = program(example_or_seed)
+
+        def infer(**limits):
+            return proto.infer_types(schema, dict(typing), budget=proto.Budget(**limits), **MODES[mode])
+
+        try:
+            unlimited = infer()
+        except proto.Contradiction:
+            continue
+        assert unlimited.incomplete is None
+        n = len(unlimited.growth)
+        if n == 0:
+            continue
+        rounds += n
+
+        # the round that finds nothing new is not charged
+        ty = infer(max_iterations=n)
+        assert ty.incomplete is None
+        assert ty.growth == unlimited.growth
+        assert ty.encoded() == unlimited.encoded()
+
+        ty = infer(max_iterations=n - 1)
+        assert ty.incomplete == "max_iterations"
+        assert ty.growth == unlimited.growth
+
+        most_facts = max(facts for facts, _ in unlimited.growth)
+        assert infer(max_facts=most_facts).incomplete is None
+        ty = infer(max_facts=most_facts - 1)
+        assert ty.incomplete == "max_facts"
+        assert ty.growth[-1][0] == most_facts
+    assert rounds > 0
@@ -0,0 +1,58 @@
+import threading
+import time
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_job_waiting_for_a_shared_render_can_be_cancelled(server, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+
+    def generate_program(*arguments):
+        started.set()
+        release.wait(10)
+        return {"svg": "<svg/>"}
+
+    monkeypatch.setattr(server, "generate_program", generate_program)
+    render = lambda job: server.cached_render("key", ("code",), job)
+    owner = server.jobs.submit(render)
+    started.wait(5)
+    waiter = server.jobs.submit(render)
+    wait_until(lambda: server.render_cache.stats()["coalesced"] == 1)
+
+    server.jobs.cancel(waiter.id)
+    wait_until(lambda: waiter.state == "cancelled")
+    assert owner.state == "running"
+
+    release.set()
+    wait_until(lambda: owner.state == "done")
+    assert owner.result == {"svg": "<svg/>"}
+    assert waiter.state == "cancelled" and waiter.result is None
+
+def test_job_whose_shared_render_was_cancelled_renders_again(server, monkeypatch):
+    calls = []
+    started = threading.Event()
+
+    def generate_program(code, job):
+        calls.append(job)
+        if len(calls) == 1:
+            started.set()
+            while not job.cancelled.wait(0.01):
+                pass
+            raise server.JobCancelled()
+        return {"svg": "<svg/>"}
+
+    monkeypatch.setattr(server, "generate_program", generate_program)
+    render = lambda job: server.cached_render("key", ("code",), job)
+    owner = server.jobs.submit(render)
+    started.wait(5)
+    waiter = server.jobs.submit(render)
+    wait_until(lambda: server.render_cache.stats()["coalesced"] == 1)
+
+    server.jobs.cancel(owner.id)
+    wait_until(lambda: waiter.state in ("done", "failed", "cancelled"))
+    assert owner.state == "cancelled"
+    assert waiter.state == "done" and waiter.result == {"svg": "<svg/>"}
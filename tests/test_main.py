@@ -0,0 +1,37 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from main import Block, RaggedTensor, add_schema, evaluate, fresh_name_generator, sort_schema, stream, sum_along_schema
+
+def streamed_result(block, inputs, size):
+    chunks = list(stream(block, {name: tensor.chunks(size) for name, tensor in inputs.items()}))
+    return RaggedTensor.concatenate(chunks).to_nested()
+
+@pytest.mark.parametrize("scalar", ["x", "y"])
+def test_stream_repeats_a_broadcast_argument_for_every_chunk(scalar):
+    d = fresh_name_generator.fresh()
+    inputs = {"x": RaggedTensor.from_nested([d], list(range(10))), "y": RaggedTensor.from_nested([d], list(range(10)))}
+    inputs[scalar] = RaggedTensor.from_nested([], 5)
+    block = Block(add_schema, [], {})
+
+    expected = evaluate(block, inputs)[0].to_nested()
+    assert expected == [i + 5 for i in range(10)]
+    assert streamed_result(block, inputs, 3) == expected
+
+def test_stream_of_scalars_is_one_chunk():
+    block = Block(add_schema, [], {})
+    inputs = {"x": RaggedTensor.from_nested([], 2), "y": RaggedTensor.from_nested([], 3)}
+    chunks = list(stream(block, {name: tensor.chunks(3) for name, tensor in inputs.items()}))
+    assert [c.to_nested() for c in chunks] == [evaluate(block, inputs)[0].to_nested()]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7])
+def test_stream_matches_evaluate_along_the_outermost_dim(size):
+    x, y = fresh_name_generator.fresh(), fresh_name_generator.fresh()
+    xs = RaggedTensor.from_nested([x, y], [[3, 1, 2], [], [5, 4], [9, 7, 8, 6]])
+    sort = Block(sort_schema, [], {"d": y})
+    total = Block(sum_along_schema, [sort], {"d": y})
+    added = Block(add_schema, [total], {})
+    inputs = {"xs": xs, "y": RaggedTensor.from_nested([], 1)}
+
+    assert streamed_result(added, inputs, size) == evaluate(added, inputs)[0].to_nested()
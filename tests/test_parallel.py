@@ -0,0 +1,63 @@
+import importlib.util
+import multiprocessing
+
+import pytest
+
+from algorithm import proto
+from programs import random_program
+
+def program_of_independent_schemas(seeds):
+    # a root over random schemas of the same two inputs, joined by unions
+    typing = {}
+    inputs = [proto.Vertex.input() for _ in range(2)]
+    output = proto.Vertex.output()
+    union = proto.builtin_schema(2, 1)
+    typing[union] = proto.union_type(2)
+    edges = {}
+    blocks = []
+    outputs = []
+    for seed in seeds:
+        schema, sub_typing = random_program(8, seed)
+        typing.update(sub_typing)
+        block = schema.instantiate()
+        for x, v in zip(inputs, schema.in_vertices):
+            edges.setdefault(x, []).append(block.mapping[v])
+        blocks.append(block)
+        outputs.append(block.mapping[schema.out_vertices[0]])
+    while len(outputs) > 1:
+        block = union.instantiate()
+        for source, v in zip(outputs[:2], union.in_vertices):
+            edges.setdefault(source, []).append(block.mapping[v])
+        blocks.append(block)
+        outputs = outputs[2:] + [block.mapping[union.out_vertices[0]]]
+    edges.setdefault(outputs[0], []).append(output)
+    return proto.BlockSchema(inputs, [output], blocks, edges), typing
+
+def typed_seeds(count: int):
+    # seeds of random schemas that type without contradiction
+    seeds = []
+    seed = 0
+    while len(seeds) < count:
+        try:
+            proto.infer_types(*random_program(8, seed))
+            seeds.append(seed)
+        except proto.Contradiction:
+            pass
+        seed += 1
+    return seeds
+
+@pytest.mark.parametrize("method", [m for m in ("spawn", "forkserver") if m in multiprocessing.get_all_start_methods()])
+def test_parallel_types_match_sequential_ones(method):
+    schema, typing = program_of_independent_schemas(typed_seeds(4))
+    expected = proto.infer_types(schema, dict(typing)).encoded()
+    ty = proto.infer_types_parallel(schema, dict(typing), 2, mp_context=multiprocessing.get_context(method))
+    assert ty.encoded() == expected
+
+def test_parallel_needs_the_module_registered():
+    spec = importlib.util.spec_from_file_location("unregistered_algorithm", proto.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    schema = module.builtin_schema(1, 1)
+    root = module.BlockSchema(schema.in_vertices, schema.out_vertices, [], {})
+    with pytest.raises(RuntimeError, match="sys.modules"):
+        module.infer_types_parallel(root, {})
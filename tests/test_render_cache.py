@@ -0,0 +1,22 @@
+import os
+
+from render_cache import RenderCache
+
+def test_rendered_results_are_reused_from_disk(tmp_path):
+    calls = []
+    compute = lambda: calls.append(1) or {"svg": "<svg/>"}
+    assert RenderCache(str(tmp_path)).get_or_compute("key", compute) == {"svg": "<svg/>"}
+    cache = RenderCache(str(tmp_path))
+    assert cache.get_or_compute("key", compute) == {"svg": "<svg/>"}
+    assert len(calls) == 1
+    assert cache.stats()["disk"] == 1
+
+def test_disk_entries_are_evicted_in_batches(tmp_path, monkeypatch):
+    cache = RenderCache(str(tmp_path), max_disk_entries=100)
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda path: listings.append(path) or listdir(path))
+    for i in range(1000):
+        cache.get_or_compute(f"{i}", lambda i=i: {"i": i})
+    assert len(os.listdir(tmp_path)) <= 100
+    assert len(listings) <= 100
@@ -0,0 +1,84 @@
+import pytest
+
+from algorithm import proto
+from checks import satisfiable
+from programs import EXAMPLES, MODES, SEEDS, example_program, program
+
+def dims(*names) -> int:
+    return proto.dim_table.dim_set(names)
+
+def dim(name):
+    return proto.dim_table.intern(name)
+
+def test_equivalent_constraints_are_one_object():
+    x, y, z = (proto.Vertex.input() for _ in range(3))
+    assert proto.InUnion(dim("a"), (y, x, y)) is proto.InUnion(dim("a"), (x, y))
+    assert (
+        proto.InducedBy(z, (proto.Inducer(y, 0), proto.Inducer(x, dims("a"))))
+        is proto.InducedBy(z, (proto.Inducer(x, dims("a")), proto.Inducer(y, 0)))
+    )
+    # X ? {a} and X ? {b} together are X, with a and b fresh
+    merged = proto.InducedBy(y, (proto.Inducer(x, dims("a")), proto.Inducer(x, dims("b"))))
+    assert merged is proto.InducedBy(y, (proto.Inducer(x, 0),), dims("a", "b"))
+
+def test_weaker_inductions_are_dropped():
+    x, y = proto.Vertex.input(), proto.Vertex.output()
+    strong = proto.InducedBy(y, (proto.Inducer(x, 0),))
+    weak = proto.InducedBy(y, (proto.Inducer(x, dims("a")),))
+    assert strong.subsumes(weak) and not weak.subsumes(strong)
+
+    store = proto.FactStore([weak])
+    assert store.add(strong)
+    assert set(store) == {strong}
+    assert not store.add(weak)
+    assert set(store) == {strong}
+
+def test_dependency_rule_keeps_the_filter_of_the_dependency():
+    # Y <== X ? {a}    b -> Y ? {c}    gives    b -> X ? {a, c}
+    x, y = proto.Vertex.input(), proto.Vertex.output()
+    induction = proto.InducedBy(y, (proto.Inducer(x, dims("a")),))
+    dependency = proto.DependsOn(dim("b"), y, dims("c"))
+    assert proto.conclusions_of(induction, dependency) == [proto.DependsOn(dim("b"), x, dims("a", "c"))]
+
+def test_in_union_rule_keeps_the_other_members_of_the_union():
+    # Y <== X    a in Union(Y, Z)    gives    a in Union(X, Z)
+    x, y, z = proto.Vertex.input(), proto.Vertex.output(), proto.Vertex.input()
+    induction = proto.InducedBy(y, (proto.Inducer(x, 0),))
+    assert proto.conclusions_of(induction, proto.InUnion(dim("a"), (y, z))) == [proto.InUnion(dim("a"), (x, z))]
+
+@pytest.mark.parametrize("fresh", [
+    # Y <== X ? {a}, as for the output of +a
+    lambda x, y: proto.InducedBy(y, (proto.Inducer(x, dims("a")),)),
+    # Y <== X with {a} fresh, as for a union of X and +a of X
+    lambda x, y: proto.InducedBy(y, (proto.Inducer(x, 0),), dims("a")),
+])
+def test_in_union_rule_does_not_push_fresh_dims_back(fresh):
+    x, y = proto.Vertex.input(), proto.Vertex.output()
+    assert proto.conclusions_of(fresh(x, y), proto.InUnion(dim("a"), (y,))) == []
+
+def test_transitive_induction_keeps_dims_fresh_on_one_path():
+    # Z <== Union(X, Y)    Y <== X ? {a}    gives    Z <== X with {a} fresh
+    x, y, z = proto.Vertex.input(), proto.Vertex.input(), proto.Vertex.output()
+    union = proto.InducedBy(z, (proto.Inducer(x, 0), proto.Inducer(y, 0)))
+    added = proto.InducedBy(y, (proto.Inducer(x, dims("a")),))
+    assert proto.conclusions_of(union, added) == [proto.InducedBy(z, (proto.Inducer(x, 0),), dims("a"))]
+
+@pytest.mark.parametrize("mode", MODES)
+def test_union_with_a_fresh_dim_types(mode):
+    schema, typing = example_program("fresh_dimension_union_example")
+    x, = schema.in_vertices
+    y, = schema.out_vertices
+    ty = proto.infer_types(schema, typing, **MODES[mode])
+    assert proto.InUnion(dim("a"), (y,)) in ty.direct_constraints
+    assert proto.NotIn(dim("a"), x) in ty.direct_constraints
+    assert proto.InducedBy(y, (proto.Inducer(x, 0),), dims("a")) in ty.indirect_constraints
+
+@pytest.mark.parametrize("example_or_seed", EXAMPLES + SEEDS)
+def test_contradictions_are_raised_for_unsatisfiable_programs_only(example_or_seed):
+    # checked against running the program on every assignment of dims to its inputs
+    schema, typing = program(example_or_seed)
+    if satisfiable(schema, typing):
+        proto.infer_types(schema, typing)
+    else:
+        with pytest.raises(proto.Contradiction):
+            proto.infer_types(schema, typing)
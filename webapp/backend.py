@@ -0,0 +1,183 @@
+"""
+A pool of long-lived backend processes (`app.jar --serve`), so requests
+do not pay JVM startup and warm-up. Messages are framed as a 4-byte
+big-endian length followed by UTF-8 JSON, see pipeline/serve.scala.
+"""
+import itertools
+import json
+import queue
+import struct
+import subprocess
+import threading
+import time
+
+DEFAULT_COMMAND = ["java", "-jar", "dfl/app.jar", "--serve"]
+
+class BackendError(RuntimeError):
+    pass
+
+class BackendTimeout(BackendError):
+    pass
+
+class BackendCancelled(BackendError):
+    pass
+
+def write_frame(stream, message):
+    data = json.dumps(message).encode("utf-8")
+    stream.write(struct.pack(">I", len(data)) + data)
+    stream.flush()
+
+def read_frame(stream):
+    # None once the process closed its stdout
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    length, = struct.unpack(">I", header)
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data.decode("utf-8"))
+
+class Worker:
+    """
+    One backend process. A reader thread moves its answers into a queue,
+    so waiting for one can time out.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.ids = itertools.count()
+        self.restarts = -1
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.answers = queue.Queue()
+        self.restarts += 1
+        threading.Thread(target=self.read_answers, args=(self.process, self.answers), daemon=True).start()
+
+    @staticmethod
+    def read_answers(process, answers):
+        while (answer := read_frame(process.stdout)) is not None:
+            answers.put(answer)
+        answers.put(None)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def stop(self, grace=0.0):
+        # closing stdin asks the backend to exit, it is killed after `grace` seconds
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(grace)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def request(self, message, timeout, cancelled=None):
+        # on a crash, timeout or cancellation the process is replaced before raising
+        message = {"id": next(self.ids), **message}
+        try:
+            write_frame(self.process.stdin, message)
+            answer = self.wait_for_answer(time.monotonic() + timeout, cancelled)
+        except queue.Empty:
+            self.restart()
+            raise BackendTimeout(f"backend did not answer within {timeout:.1f}s")
+        except OSError as e:
+            self.restart()
+            raise BackendError(f"backend crashed: {e}")
+        if answer is None:
+            code = self.process.wait()
+            self.restart()
+            raise BackendError(f"backend exited with code {code}")
+        if answer.get("id") != message["id"]:
+            self.restart()
+            raise BackendError(f"backend answered {answer.get('id')} to request {message['id']}")
+        return answer
+
+    def wait_for_answer(self, deadline, cancelled):
+        # waits in short slices when the request can be cancelled
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Empty
+            try:
+                return self.answers.get(timeout=remaining if cancelled is None else min(remaining, 0.1))
+            except queue.Empty:
+                if cancelled is not None and cancelled.is_set():
+                    self.restart()
+                    raise BackendCancelled("request was cancelled")
+
+class BackendPool:
+    """
+    Keeps `size` warm workers. Requests take an idle worker and wait for
+    one up to `timeout`; a health check pings idle workers every
+    `health_interval` seconds and restarts those that do not answer.
+    """
+
+    def __init__(self, size=2, command=DEFAULT_COMMAND, timeout=30.0, health_interval=10.0, health_timeout=5.0):
+        self.timeout = timeout
+        self.health_timeout = health_timeout
+        self.workers = [Worker(command) for _ in range(size)]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.closed = threading.Event()
+        if health_interval:
+            threading.Thread(target=self.check_health_every, args=(health_interval,), daemon=True).start()
+
+    def request(self, message, timeout=None, cancelled=None):
+        # `cancelled` is a threading.Event that abandons the request once set
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        try:
+            worker = self.idle.get(timeout=timeout)
+        except queue.Empty:
+            raise BackendTimeout(f"no backend worker free within {timeout:.1f}s")
+        try:
+            if not worker.alive():
+                worker.restart()
+            return worker.request(message, max(timeout - (time.monotonic() - started), 0.001), cancelled)
+        finally:
+            self.idle.put(worker)
+
+    def compile(self, source, output, expansion_depth, typing=None, timeout=None, cancelled=None):
+        message = {"kind": "compile", "source": source, "output": output, "expansionDepth": expansion_depth}
+        if typing is not None:
+            message["typing"] = typing
+        return self.request(message, timeout, cancelled)
+
+    def check_health(self):
+        # pings the workers idle right now, busy ones are answering anyway
+        for _ in range(len(self.workers)):
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                if not worker.alive():
+                    worker.restart()
+                worker.request({"kind": "ping"}, self.health_timeout)
+            except BackendError as e:
+                print(f"Backend health check failed: {e}")
+            finally:
+                self.idle.put(worker)
+
+    def check_health_every(self, interval):
+        while not self.closed.wait(interval):
+            self.check_health()
+
+    def status(self):
+        return [{"pid": w.process.pid, "alive": w.alive(), "restarts": w.restarts} for w in self.workers]
+
+    def close(self):
+        self.closed.set()
+        for worker in self.workers:
+            worker.stop(grace=1.0)
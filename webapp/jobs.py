@@ -0,0 +1,153 @@
+"""
+Background render jobs: submitted, polled or followed stage by stage,
+fetched when done and cancelled. A bounded pool runs them and refuses
+new jobs once its queue is full.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+FINISHED = ("done", "failed", "cancelled")
+
+class JobCancelled(Exception):
+    pass
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    """
+    State of one job. Every change bumps `version` and wakes threads in
+    wait_for_change. The running job calls enter() at each stage, which
+    raises JobCancelled once the job was cancelled.
+    """
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.state = "queued"
+        self.stages = []
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.cancelled = threading.Event()
+        self.changed = threading.Condition()
+        self.version = 0
+
+    def update(self, **fields):
+        with self.changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self.changed.notify_all()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+    def enter(self, stage: str):
+        self.check()
+        now = time.time()
+        stages = [dict(s) for s in self.stages]
+        if stages:
+            stages[-1]["seconds"] = now - stages[-1]["started"]
+        stages.append({"name": stage, "started": now})
+        self.update(state="running", stages=stages)
+
+    def finish(self, state: str, result=None, error=None):
+        stages = [dict(s) for s in self.stages]
+        if stages and "seconds" not in stages[-1]:
+            stages[-1]["seconds"] = time.time() - stages[-1]["started"]
+        self.update(state=state, stages=stages, result=result, error=error, finished_at=time.time())
+
+    def snapshot(self) -> dict:
+        with self.changed:
+            return {
+                "id": self.id,
+                "state": self.state,
+                "stage": self.stages[-1]["name"] if self.stages else None,
+                "stages": self.stages,
+                "error": None if self.error is None else str(self.error),
+            }
+
+    def wait_for_change(self, version: int, timeout: float):
+        # snapshot and version once newer than `version`, or after `timeout` anyway
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.snapshot(), self.version
+
+class JobQueue:
+    """
+    Runs jobs on `workers` threads with at most `max_queued` waiting.
+    submit raises QueueFull beyond that. Finished jobs are forgotten
+    `keep_seconds` after they finish.
+    """
+
+    def __init__(self, workers: int = 2, max_queued: int = 16, keep_seconds: float = 600.0):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.capacity = workers + max_queued
+        self.keep_seconds = keep_seconds
+        self.jobs = {}
+        self.futures = {}
+        self.active = 0
+        self.lock = threading.Lock()
+
+    def submit(self, run) -> Job:
+        # run(job) computes the result, calling job.enter at every stage
+        job = Job()
+        with self.lock:
+            self.forget_finished()
+            if self.active >= self.capacity:
+                raise QueueFull(f"{self.active} jobs are already queued or running")
+            self.active += 1
+            self.jobs[job.id] = job
+            self.futures[job.id] = self.executor.submit(self.execute, job, run)
+        return job
+
+    def execute(self, job: Job, run):
+        try:
+            job.check()
+            job.update(state="running")
+            job.finish("done", result=run(job))
+        except JobCancelled:
+            job.finish("cancelled")
+        except Exception as e:
+            job.finish("failed", error=e)
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.futures.pop(job.id, None)
+
+    def get(self, job_id: str):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        # queued jobs never start, running ones stop at their next stage or sooner
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state in FINISHED:
+                return job
+            job.cancelled.set()
+            future = self.futures.get(job_id)
+            if future is not None and future.cancel():
+                self.active -= 1
+                del self.futures[job_id]
+                job.finish("cancelled")
+        return job
+
+    def forget_finished(self):
+        now = time.time()
+        for job_id in [
+            j.id for j in self.jobs.values()
+            if j.finished_at is not None and now - j.finished_at > self.keep_seconds
+        ]:
+            del self.jobs[job_id]
+
+    def stats(self) -> dict:
+        with self.lock:
+            states = {}
+            for job in self.jobs.values():
+                states[job.state] = states.get(job.state, 0) + 1
+            return {"active": self.active, "capacity": self.capacity, "jobs": states}
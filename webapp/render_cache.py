@@ -0,0 +1,129 @@
+"""
+Cache of rendered programs keyed by the content of the request, so
+re-rendering the same program costs a lookup.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, wait
+
+# eviction is shared with the block type cache of the prototype
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prototype"))
+from disk_lru import LruEviction
+
+class WaitCancelled(Exception):
+    pass
+
+def render_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+def files_version(*paths) -> str:
+    # changes whenever one of the files does, missing files count too
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode("utf-8"))
+        except OSError:
+            digest.update(f"{path}:missing;".encode("utf-8"))
+    return digest.hexdigest()
+
+class RenderCache:
+    """
+    Rendered results (JSON-serializable dicts) in an in-memory LRU of at
+    most max_memory_bytes, backed by one JSON file per entry in
+    `directory`. Disk entries are written atomically, refreshed on reads
+    and the least recently used are evicted above max_disk_entries (see
+    LruEviction).
+    Concurrent requests for a key being computed wait for that computation.
+    """
+
+    def __init__(self, directory: str, max_memory_bytes: int = 64 << 20, max_disk_entries: int = 4096):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_entries = max_disk_entries
+        os.makedirs(self.directory, exist_ok=True)
+        self.eviction = LruEviction(self.directory, max_disk_entries)
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.hits = {"memory": 0, "disk": 0, "coalesced": 0, "miss": 0}
+
+    def get_or_compute(self, key: str, compute, cancelled=None):
+        # errors of compute are not cached, they reach every waiting caller.
+        # `cancelled` is a threading.Event, once set a caller waiting for another
+        # one's computation raises WaitCancelled, the computation goes on
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits["memory"] += 1
+                return self.memory[key][0]
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self.in_flight[key] = Future()
+            else:
+                self.hits["coalesced"] += 1
+        if not owner:
+            while cancelled is not None and not wait([future], timeout=0.1).done:
+                if cancelled.is_set():
+                    raise WaitCancelled(f"stopped waiting for the render of {key}")
+            return future.result()
+
+        try:
+            value = self.disk_get(key)
+            with self.lock:
+                self.hits["disk" if value is not None else "miss"] += 1
+            if value is None:
+                value = compute()
+                self.disk_put(key, value)
+            self.memory_put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def memory_put(self, key: str, value: dict):
+        size = len(json.dumps(value))
+        with self.lock:
+            if key in self.memory:
+                self.memory_bytes -= self.memory.pop(key)[1]
+            self.memory[key] = (value, size)
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_memory_bytes and self.memory:
+                _, (_, evicted) = self.memory.popitem(last=False)
+                self.memory_bytes -= evicted
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def disk_get(self, key: str):
+        try:
+            with open(self.path(key)) as f:
+                value = json.load(f)
+            os.utime(self.path(key))
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def disk_put(self, key: str, value: dict):
+        added = not os.path.exists(self.path(key))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self.path(key))
+        if added:
+            self.eviction.added()
+
+    def stats(self):
+        with self.lock:
+            return {**self.hits, "memory_entries": len(self.memory), "memory_bytes": self.memory_bytes}
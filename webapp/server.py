@@ -1,68 +1,246 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
+import atexit
+import base64
+import json
+import os
 import pathlib
 import requests
+import shlex
 import subprocess
 import tempfile
+import threading
 
+from backend import DEFAULT_COMMAND, BackendCancelled, BackendError, BackendPool, BackendTimeout
+from jobs import FINISHED, JobCancelled, JobQueue, QueueFull
+from render_cache import RenderCache, WaitCancelled, files_version, render_key
+import model
 import visualization
 
 pathlib.Path('dfl').mkdir(parents=True, exist_ok=True)
 
-with open('dfl/typing.txt', 'w') as f:
-    f.write("")
+backend_pool = None
+backend_lock = threading.Lock()
+
+def backend():
+    # started on first use, so importing this module starts no process
+    global backend_pool
+    with backend_lock:
+        if backend_pool is None:
+            backend_pool = BackendPool(
+                size=int(os.environ.get("DFL_BACKEND_WORKERS", "2")),
+                command=shlex.split(os.environ.get("DFL_BACKEND_COMMAND", "")) or DEFAULT_COMMAND,
+                timeout=float(os.environ.get("DFL_BACKEND_TIMEOUT", "30")),
+            )
+            atexit.register(backend_pool.close)
+        return backend_pool
+
+render_cache = RenderCache(
+    os.path.join('dfl', 'render-cache'),
+    max_memory_bytes=int(os.environ.get("DFL_RENDER_CACHE_BYTES", str(64 << 20))),
+)
+
+jobs = JobQueue(
+    workers=int(os.environ.get("DFL_JOB_WORKERS", "2")),
+    max_queued=int(os.environ.get("DFL_JOB_QUEUE", "16")),
+)
+
+def renderer_version():
+    # rebuilding the backend or editing the visualization invalidates cached renders
+    return files_version('dfl/app.jar', model.__file__, visualization.__file__, __file__)
 
 app = Flask(__name__,
     static_url_path='/static',
     static_folder='static',
 )
 
-def generate_program(code, expansionDepth, show_typing):
-    with open("dfl/file.dfl", "w") as f:
-        f.write(code)
-
-    command = [
-        "java",
-        "-jar",
-        "dfl/app.jar",
-        "dfl/file.dfl",
-        "dfl/file.json",
-        expansionDepth,
-    ]
-    if show_typing == 'true':
-       command.append('dfl/typing.txt')
-    print("Running " + ' '.join(map(str, command)))
-    subprocess.run(command)
-    return visualization.json_to_graphviz("dfl/file.json", int(expansionDepth))
-        
+DOT_TIMEOUT = float(os.environ.get("DFL_DOT_TIMEOUT", "30"))
+
+class CompileError(Exception):
+    pass
+
+class RenderError(Exception):
+    pass
+
+class UnsupportedFormat(Exception):
+    pass
+
+# the most specific class comes first, BackendTimeout is a BackendError
+ERROR_STATUS = [
+    (UnsupportedFormat, 400),
+    (CompileError, 422),
+    (QueueFull, 429),
+    (RenderError, 500),
+    (BackendTimeout, 504),
+    (BackendError, 502),
+]
+
+def error_response(error):
+    status = next((s for kind, s in ERROR_STATUS if isinstance(error, kind)), 500)
+    headers = {'Retry-After': '1'} if isinstance(error, QueueFull) else {}
+    return jsonify({'error': str(error)}), status, headers
+
+def kill_when_cancelled(process, cancelled):
+    while process.poll() is None:
+        if cancelled.wait(0.1):
+            process.kill()
+            return
+
+def render_dot(graphviz_code, image_format, cancelled=None):
+    # one dot process, the source goes in through stdin and the image comes out of stdout.
+    # It is killed on timeout or once `cancelled` is set.
+    process = subprocess.Popen(
+        ['dot', '-n', f'-T{image_format}'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    if cancelled is not None:
+        threading.Thread(target=kill_when_cancelled, args=(process, cancelled), daemon=True).start()
+    try:
+        image, errors = process.communicate(graphviz_code.encode('utf-8'), timeout=DOT_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise RenderError(f"dot did not finish within {DOT_TIMEOUT}s")
+    if cancelled is not None and cancelled.is_set():
+        raise JobCancelled()
+    if process.returncode != 0:
+        raise RenderError(errors.decode('utf-8', 'replace'))
+    return image
+
+def generate_program(code, expansionDepth, show_typing, image_format, job=None):
+    # every request works in its own directory, removed once it is answered,
+    # so concurrent requests never see each other's files.
+    # With a job, stages are reported to it and it can stop the work.
+    enter = job.enter if job is not None else lambda stage: None
+    cancelled = job.cancelled if job is not None else None
+    with tempfile.TemporaryDirectory(prefix='request-', dir='dfl') as workspace:
+        workspace = pathlib.Path(workspace).resolve()
+        source = workspace / 'file.dfl'
+        output = workspace / 'file.json'
+        typing = workspace / 'typing.txt' if show_typing == 'true' else None
+        source.write_text(code)
+
+        # the backend parses, types and builds the program in one go
+        enter('compile')
+        try:
+            answer = backend().compile(
+                str(source), str(output), int(expansionDepth), typing and str(typing), cancelled=cancelled,
+            )
+        except BackendCancelled:
+            raise JobCancelled()
+        print(answer["log"])
+        if not output.exists():
+            raise CompileError(answer["log"])
+        enter('graph')
+        graphviz_code = visualization.json_to_graphviz(output, int(expansionDepth))
+        ty = typing.read_text() if typing is not None and typing.exists() else None
 
+    print(graphviz_code)
+    enter('layout')
+    image = render_dot(graphviz_code, image_format, cancelled)
+    if image_format == 'svg':
+        return {'svg': image.decode('utf-8'), 'ty': ty}
+    return {image_format: base64.b64encode(image).decode('ascii'), 'ty': ty}
+
+def render_arguments(expansionDepth):
+    # cache key and generate_program arguments of the render the current request asks for
+    code = request.get_json()['code']
+    show_typing = request.args.get("typing")
+    image_format = request.args.get("format", "svg")
+    if image_format not in ('svg', 'png'):
+        raise UnsupportedFormat(f"Unsupported format {image_format}")
+    key = render_key(code, int(expansionDepth), show_typing == 'true', image_format, renderer_version())
+    return key, (code, expansionDepth, show_typing, image_format)
+
+def cached_render(key, arguments, job=None):
+    cancelled = job.cancelled if job is not None else None
+    while True:
+        try:
+            return render_cache.get_or_compute(key, lambda: generate_program(*arguments, job), cancelled)
+        except WaitCancelled:
+            # this job was cancelled while waiting for another caller's render
+            raise JobCancelled()
+        except JobCancelled:
+            # the cancelled render may be another job's this one waited for, then it is redone
+            if job is not None and job.cancelled.is_set():
+                raise
 
 @app.route('/generate-image/<expansionDepth>', methods=['POST'])
 def generate_image(expansionDepth):
-    data = request.get_json()
-    code = data['code']
-    show_typing = request.args.get("typing")
+    try:
+        result = cached_render(*render_arguments(expansionDepth))
+    except (UnsupportedFormat, CompileError, RenderError, BackendError) as e:
+        return error_response(e)
+    return jsonify(result)
 
-    graphviz_code = generate_program(code, expansionDepth, show_typing)
-    print(graphviz_code)
-    with tempfile.NamedTemporaryFile(suffix='.dot', delete=False) as f:
-        f.write(graphviz_code.encode('utf-8'))
-        f.flush()
-        output_path_png = f.name.replace('.dot', '.png')
-        output_path_svg = f.name.replace(".dot", ".svg")
-        subprocess.run(['dot', '-n', '-Tpng', f.name, '-o', output_path_png])
-        subprocess.run(['dot', '-n', '-Tsvg', f.name, '-o', output_path_svg])
-        return send_file(output_path_svg, mimetype='image/svg')
-
-@app.route('/get-typing', methods=['GET'])
-def get_typing():
-    with open('dfl/typing.txt') as f:
-        ty = f.read()
-    return jsonify({'ty': ty})
+@app.route('/submit-job/<expansionDepth>', methods=['POST'])
+def submit_job(expansionDepth):
+    try:
+        key, arguments = render_arguments(expansionDepth)
+        job = jobs.submit(lambda job: cached_render(key, arguments, job))
+    except (UnsupportedFormat, QueueFull) as e:
+        return error_response(e)
+    return jsonify(job.snapshot()), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"No job {job_id}"}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': f"No job {job_id}"}), 404
+    return jsonify(job.snapshot()), 202
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"No job {job_id}"}), 404
+    if job.state == 'done':
+        return jsonify(job.result)
+    if job.state == 'failed':
+        return error_response(job.error)
+    if job.state == 'cancelled':
+        return jsonify(job.snapshot()), 410
+    return jsonify(job.snapshot()), 409
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # server-sent events with the job's state on every change, until it finishes
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f"No job {job_id}"}), 404
+
+    def events():
+        version = None
+        while True:
+            snapshot, version = job.wait_for_change(version, timeout=15)
+            yield f"data: {json.dumps(snapshot)}\n\n"
+            if snapshot['state'] in FINISHED:
+                return
+
+    return Response(events(), mimetype='text/event-stream')
+
+@app.route('/backend-status', methods=['GET'])
+def backend_status():
+    return jsonify(backend().status())
+
+@app.route('/render-cache-status', methods=['GET'])
+def render_cache_status():
+    return jsonify(render_cache.stats())
+
+@app.route('/job-status', methods=['GET'])
+def job_queue_status():
+    return jsonify(jobs.stats())
 
 @app.route("/", methods=['GET'])
 def index():
     return send_file('index.html')
 
 if __name__ == '__main__':
-    app.run(port=5000)
+    app.run(port=5000, threaded=True)
 
@@ -101,17 +101,12 @@ function update() {
         }
     ).then(response => {
         if (!response.ok) throw new Error("Non ok result status");
-        return response.text()
+        return response.json()
     })
-        .then(svg => {
-            document.getElementById("codeImage").innerHTML = svg
+        .then(result => {
+            document.getElementById("codeImage").innerHTML = result.svg
             if (showTyping) {
-                fetch('/get-typing').then(r => {
-                    if (!r.ok) throw new Error("Non ok return status");
-                    return r.json()
-                }).then(txt => {
-                    document.getElementById("typeBox").innerText = txt.ty;
-                });
+                document.getElementById("typeBox").innerText = result.ty;
             } else {
                 document.getElementById("typeBox").innerHTML = "N/A";
             }
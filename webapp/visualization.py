@@ -1,4 +1,5 @@
 import json
+import re
 from textwrap import dedent
 
 from model import *
@@ -19,7 +20,8 @@ def json_to_graphviz(path, expansion_depth):
 
 def program_to_graphviz(program: Program, depth: int):
     id_generator = IdGenerator()
-    schemata_str = "\n".join(schema_to_graphviz(s, program, depth, id_generator) for s in program.schemata)
+    templates = {}
+    schemata_str = "\n".join(schema_to_graphviz(s, program, depth, id_generator, templates=templates) for s in program.schemata)
     return dedent(f"""\
     digraph G {{ 
         rankdir = TB
@@ -30,17 +32,77 @@ def program_to_graphviz(program: Program, depth: int):
     }}"""
     )
 
+# Placeholders of a subgraph template: ids relative to the instance's first id,
+# names of interface vertices and dims in the order of their mapping keys.
+# NUL never occurs in the rendered text itself.
+PLACEHOLDER = re.compile("\0([ivd])(\\d+)\0")
+
+def placeholder(kind, index):
+    return f"\0{kind}{index}\0"
+
+class TemplateIdGenerator:
+    def __init__(self):
+        self.next_id = 0
+
+    def next(self):
+        result = placeholder("i", self.next_id)
+        self.next_id += 1
+        return result
+
+class SubgraphTemplate:
+    """
+    Rendering of one schema at one depth with placeholders for whatever
+    differs between its instances, so every instance costs one substitution.
+    """
+
+    def __init__(self, text, id_count):
+        parts = PLACEHOLDER.split(text)
+        self.literals = parts[0::3]
+        self.slots = [(kind, int(index)) for kind, index in zip(parts[1::3], parts[2::3])]
+        self.id_count = id_count
+
+    def stamp(self, id_generator, vertex_names, dim_names):
+        # ids are drawn in the order rendering the instance directly would draw them
+        values = {
+            "i": [str(id_generator.next()) for _ in range(self.id_count)],
+            "v": vertex_names,
+            "d": dim_names,
+        }
+        pieces = [self.literals[0]]
+        for (kind, index), literal in zip(self.slots, self.literals[1:]):
+            pieces.append(values[kind][index])
+            pieces.append(literal)
+        return "".join(pieces)
+
 def schema_to_graphviz(
     schema: Schema, 
     program: Program, 
     depth: int, 
     id_generator: IdGenerator,
     interface_mapping=None,
-    dim_mapping=None
+    dim_mapping=None,
+    templates=None,
     ):
+    # the rendering depends on which vertices and dims are mapped, not on what they are mapped to
     interface_mapping = interface_mapping or {}
     dim_mapping = dim_mapping or {}
+    templates = {} if templates is None else templates
+    key = (schema.id, depth, tuple(interface_mapping), tuple(dim_mapping))
+    if key not in templates:
+        template_ids = TemplateIdGenerator()
+        text = render_schema(
+            schema,
+            program,
+            depth,
+            template_ids,
+            {v: placeholder("v", i) for i, v in enumerate(interface_mapping)},
+            {d: placeholder("d", i) for i, d in enumerate(dim_mapping)},
+            templates,
+        )
+        templates[key] = SubgraphTemplate(text, template_ids.next_id)
+    return templates[key].stamp(id_generator, list(interface_mapping.values()), list(dim_mapping.values()))
 
+def render_schema(schema, program, depth, id_generator, interface_mapping, dim_mapping, templates):
     cluster_name = f"cluster_{id_generator.next()}"
     block_title = schema.name.replace("builtin ", "")
 
@@ -100,7 +162,8 @@ def schema_to_graphviz(
                     d : dim_name_mapping[block.dim_mapping[d]] if d in dim_name_mapping
                         else dim_name(block.dim_mapping[d])
                     for d in block.dim_mapping
-                }
+                },
+                templates,
             )
             for block in schema.blocks
         )